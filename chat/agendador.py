@@ -0,0 +1,129 @@
+import concurrent.futures
+import queue
+import random
+
+from main import (
+    NUM_TURNOS, REGRAS_VENDEDOR, gerar_resposta, gerar_resposta_vendedor_validada,
+    preparar_contexto, criar_regras_comprador
+)
+from registro import ConversaCompacta
+from utils import INSTRUCAO_PRIMEIRA_PERGUNTA, INSTRUCAO_PROXIMA_PERGUNTA
+
+class EstadoConversa:
+    """
+    Conversa em andamento vista como máquina de estados: em cada momento ela tem no
+    máximo uma requisição pendente (a pergunta do comprador ou a resposta do vendedor
+    do turno atual), e o resultado dessa requisição a leva ao próximo estado.
+    """
+    __slots__ = ("numero", "cenario", "intencao", "regras_comprador", "conversa", "historico", "turno", "agente")
+
+    def __init__(self, numero, cenario, intencao=None, contexto=None):
+        self.numero = numero
+        self.cenario = cenario
+        self.intencao = intencao if intencao is not None else random.choice(cenario["intencoes"])
+        if contexto is None:
+            contexto = preparar_contexto(cenario)
+        self.regras_comprador = criar_regras_comprador(contexto, self.intencao)
+        self.conversa = ConversaCompacta()
+        self.historico = []
+        self.turno = 0
+        self.agente = "comprador"
+
+    @property
+    def concluida(self):
+        return self.turno >= NUM_TURNOS
+
+    def executar_requisicao(self):
+        """
+        Faz a chamada do estado atual (executada por um trabalhador do agendador).
+
+        Returns:
+            Tupla (resposta, sistema_prompt, user_prompt)
+        """
+        # Sem o cache global: com milhares de conversas abertas ele cresceria sem limite e
+        # repetiria conversas inteiras quando o mesmo contexto e intenção fossem sorteados
+        if self.agente == "comprador":
+            if self.turno == 0:
+                return gerar_resposta(
+                    [], INSTRUCAO_PRIMEIRA_PERGUNTA, "comprador", self.regras_comprador, usar_cache=False
+                )
+            return gerar_resposta(
+                self.historico, INSTRUCAO_PROXIMA_PERGUNTA, "comprador", self.regras_comprador, usar_cache=False
+            )
+
+        pergunta = self.historico[-1]["content"]
+        return gerar_resposta_vendedor_validada(self.historico, pergunta, REGRAS_VENDEDOR, usar_cache=False)
+
+    def avancar(self, resultado):
+        """
+        Registra o resultado da requisição e passa para a próxima etapa da conversa.
+        """
+        resposta, sistema_prompt, user_prompt = resultado
+        self.historico.append({"role": self.agente, "content": resposta})
+        self.conversa.adicionar(self.turno + 1, self.agente, resposta, sistema_prompt, user_prompt)
+
+        if self.agente == "comprador":
+            self.agente = "vendedor"
+        else:
+            self.agente = "comprador"
+            self.turno += 1
+
+def executar_agendador(plano, ao_concluir, num_trabalhadores=32, max_em_andamento=1000):
+    """
+    Gera muitas conversas intercaladas: sempre que uma conversa tem a próxima requisição
+    pronta, ela entra na fila de despacho compartilhada, e o resultado avança a conversa
+    correspondente. Assim a vazão depende do número de requisições simultâneas
+    (num_trabalhadores), e não da latência de ida e volta de cada conversa.
+
+    Args:
+        plano: Iterável de (numero, cenario), (numero, cenario, intencao) ou
+            (numero, cenario, intencao, contexto) com as conversas a gerar
+        ao_concluir: Função chamada com cada EstadoConversa concluído
+        num_trabalhadores: Máximo de requisições simultâneas ao modelo
+        max_em_andamento: Máximo de conversas abertas ao mesmo tempo
+
+    Returns:
+        Número de conversas concluídas
+    """
+    plano = iter(plano)
+    concluidas = 0
+    em_andamento = 0
+
+    # Resultados chegam nesta fila na ordem em que terminam, em O(1) por requisição
+    resultados = queue.Queue()
+
+    def despachar(estado):
+        futuro = executor.submit(estado.executar_requisicao)
+        futuro.add_done_callback(lambda f: resultados.put((estado, f)))
+
+    def admitir():
+        # Abre novas conversas até o limite de conversas em andamento
+        nonlocal em_andamento
+        while em_andamento < max_em_andamento:
+            proximo = next(plano, None)
+            if proximo is None:
+                return
+            despachar(EstadoConversa(*proximo))
+            em_andamento += 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_trabalhadores) as executor:
+        admitir()
+        while em_andamento:
+            estado, futuro = resultados.get()
+            try:
+                estado.avancar(futuro.result())
+            except Exception as e:
+                print(f"Erro na conversa {estado.numero} ({estado.cenario['tipo']}): {str(e)}. Descartando...")
+                em_andamento -= 1
+                admitir()
+                continue
+
+            if estado.concluida:
+                em_andamento -= 1
+                concluidas += 1
+                ao_concluir(estado)
+                admitir()
+            else:
+                despachar(estado)
+
+    return concluidas
@@ -1,9 +1,17 @@
 import os
 import json
 import random
+import re
+import threading
 import time
 import google.generativeai as genai
-from utils import salvar_conversa
+from utils import (
+    salvar_conversa, formatar_historico, criar_prompt_template,
+    INSTRUCAO_PRIMEIRA_PERGUNTA, INSTRUCAO_PROXIMA_PERGUNTA,
+    RESPOSTAS_FALLBACK_COMPRADOR, RESPOSTAS_FALLBACK_VENDEDOR
+)
+from validador import validar_resposta_vendedor, PADRAO_ABERTURA, ROTULO_ENTRADA
+from registro import ConversaCompacta
 from dotenv import load_dotenv
 
 # Carrega as variáveis de ambiente do arquivo .env
@@ -11,15 +19,27 @@ load_dotenv()
 
 # Configuração do Gemini AI
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY não encontrada. Verifique se o arquivo .env existe e contém a chave.")
 
-# Configuração do modelo
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.0-flash')
-except Exception as e:
-    raise Exception(f"Erro ao configurar o modelo Gemini: {str(e)}")
+# O modelo é configurado no primeiro uso (ver obter_modelo), para que quem só monta
+# prompts, como o planejador, possa importar este módulo sem a chave da API
+model = None
+lock_modelo = threading.Lock()
+
+def obter_modelo():
+    """
+    Retorna o modelo Gemini, configurando o cliente na primeira chamada.
+    """
+    global model
+    with lock_modelo:
+        if model is None:
+            if not GEMINI_API_KEY:
+                raise ValueError("GEMINI_API_KEY não encontrada. Verifique se o arquivo .env existe e contém a chave.")
+            try:
+                genai.configure(api_key=GEMINI_API_KEY)
+                model = genai.GenerativeModel('gemini-2.0-flash')
+            except Exception as e:
+                raise Exception(f"Erro ao configurar o modelo Gemini: {str(e)}")
+    return model
 
 # Cria o diretório 'data' se não existir
 os.makedirs('data', exist_ok=True)
@@ -229,37 +249,182 @@ CENARIOS_COMPRA = [
     }
 ]
 
+# Regras do vendedor (iguais para todos os cenários)
+REGRAS_VENDEDOR = """
+    You are an agent specialized in our car sales system. Your main task is to guide the conversation to collect all the details needed to create a complete listing. The mandatory fields are (**"brand"** or **model**), **"salePrice"**, and **"state"**.
+
+You have access to memory. It contains the conversation history in an array with "User" and "Assistant" entries. Always use the data from memory as the conversation history.
+
+# Main Objectives
+- **Collect information efficiently**: Obtain all necessary details without repeating questions about information already provided.
+- **Extract conversation history**: Analyze the user's input to identify and update the filters: brand, title, year, price. state should be retrieved from memory.
+- **Avoid redundancy**: Only request information that hasn't been provided yet, updating the data based on the current input.
+- **Override older data with newer data**: If the user contradicts or changes previous preferences, update the relevant field(s) with the most recent input.
+
+# Response Format
+Strictly follow this structure (Thought, NextAgent and FinalResponse):
+
+---
+Input: The message from the user.  
+Thought: Explain your reasoning clearly and concisely. Justify the next action based on the user's input and details already collected. Highlight why missing details (especially brand, salePrice, or state) are essential. If the user modifies a previously provided field, explain how you override the old data.   
+ActionInput: A JSON object with all parameters collected so far ("brand", "salePrice", "state"...). Use information from the current input and conversation history, but override any conflicting older values with the newest input.  
+NextAgent: "ListingAgent" only when "brand" or "model", "salePrice", and "state" are present; otherwise, leave empty.  
+FinalResponse: "Movendo para o próximo agente" (if brand or model, salePrice, and state are collected) or a polite request in Brazilian Portuguese for missing details (e.g., "Por favor, informe o preço do carro."). Never ask for the "state", always retrieve it from memory.  
+---
+
+# Rules
+- **Prioritize the current input**: If the user provides clear information (e.g., "the brand is Chevrolet"), record it in ActionInput immediately, even if the history contains something different (e.g., "Honda"). Use the history only to fill fields not mentioned in the current input.
+- **If the user's new statement conflicts with previously stored data in memory, override the old data in ActionInput with the new statement.**
+- **Avoid unnecessary clarifications**: If the input already answers a mandatory field (brand or model, salePrice, or state), don't question it unless it's contradictory or ambiguous.
+- **Use the model if provided**: Theres no need to ask for the brand if the user already provided the model of the car (e.g. "Onix", "Renegade")
+- **Update ActionInput correctly**: The JSON in ActionInput must always reflect the current state of collected data, combining history and the current input, with priority given to the input in case of conflict.
+- **Request only what's missing**: After updating ActionInput, ask only for the mandatory fields still missing in FinalResponse.
+- **Transition to the next agent**: If "brand" (or "model"), "salePrice", and "state" are filled, set NextAgent to "ListingAgent" and FinalResponse to "Movendo para o próximo agente".
+- **The "state" returned in ActionInput must be a Brazilian state, retrieved from memory, with exactly 2 letters (e.g., "São Paulo" -> "SP").**
+- **Color Must Be Masculine**: If the user provides a color in feminine form (e.g., "preta", "branca", "vermelha"), always convert it to masculine (e.g., "preto", "branco", "vermelho") when storing in ActionInput.
+
+# Response Examples
+
+## Example 1:
+**Input**: O que você tem de Fiat Strada branco de até 50 mil?  
+**Expected Output**:
+---
+Thought: The user provided the brand (Fiat), model (Strada), color (branco), and salePrice (50000). I will retrieve the "state" from memory.  
+ActionInput: {"brand": "Fiat", "model": "Strada", "color": "branco", "salePrice": "50000", "state": "RS"}  
+NextAgent: ListingAgent  
+FinalResponse: "Movendo para o próximo agente"  
+---
+
+## Example 2:
+**Input**: O que você tem carro com fipe até 40 mil?  
+**Expected Output**:
+---
+Thought: The user specified a salePrice limit (40000). I will assume they meant "salePrice" and retrieve brand and state from memory if available. Since this example lacks prior context, I'll request the missing fields.  
+ActionInput: {"salePrice": "40000"}  
+NextAgent:   
+FinalResponse: Por favor, informe os detalhes para que eu possa lhe ajudar.  
+---
+
+## Example 3 (Overriding Previous Info):
+**Input**:  
+1) "Estou procurando um Camaro amarelo."  
+2) "Aliás, melhor um preto."  
+**Expected Output after the second input**:
+---
+Thought: The user initially gave color "amarelo" but then changed it to "preto." I will override the old color in ActionInput with "preto."   
+ActionInput: {"model": "Camaro", "color": "preto"}  
+NextAgent:   
+FinalResponse: Por favor, informe o preço do carro.  
+---
+
+# Implementation Tips
+- If you maintain a conversation history snippet, label it as **"Filtros atuais (dados mais recentes)"** (or similar) before the JSON, to indicate they're subject to change.
+- Analyze the user's input to extract conversation history, but always use the newest input to override conflicting older details.
+- Adapt keywords based on your users' vocabulary (e.g., "used", "new", "value", "cash").
+- Ensure the output strictly follows the defined format, without variations.
+- Always store color in masculine form if the user uses a feminine variant.
+- You only need the brand or the model, dont require both. The model of the car is enought. As well as only the brand.
+    """
+
 # Cache para evitar chamadas repetidas à API
 resposta_cache = {}
 
-def formatar_historico(historico, perspectiva):
+# Modo streaming: consome os tokens conforme chegam e aborta cedo respostas fora do formato
+USAR_STREAMING = os.getenv('USAR_STREAMING', 'false').lower() in ('1', 'true', 'sim')
+
+# Campos obrigatórios da resposta do vendedor, na ordem em que devem aparecer
+CAMPOS_VENDEDOR = ["Thought:", "ActionInput:", "NextAgent:", "FinalResponse:"]
+
+# Limite de frases da resposta final quando max_tokens está ativo
+MAX_FRASES_CURTAS = 2
+
+# Limite de tokens de saída por chamada (respostas curtas quando max_tokens está ativo)
+MAX_TOKENS_SAIDA = 500
+MAX_TOKENS_SAIDA_CURTA = 150
+
+# Número de turnos (pergunta do comprador + resposta do vendedor) por conversa
+NUM_TURNOS = 6
+
+# Número máximo de regenerações de um turno do vendedor que falhou na validação
+MAX_REGENERACOES_TURNO = 2
+
+def verificar_resposta_parcial(texto, tipo_agente, max_tokens=None):
     """
-    Formata o histórico de conversa com a perspectiva correta (comprador ou vendedor).
-    
+    Verifica se uma resposta parcial (ainda em streaming) já quebrou o formato ou o limite de tamanho.
+
     Args:
-        historico: Lista de mensagens no formato {"role": "comprador"|"vendedor", "content": "mensagem"}
-        perspectiva: "comprador" ou "vendedor" - quem está recebendo o histórico
-        
+        texto: Texto acumulado até o momento
+        tipo_agente: "comprador" ou "vendedor"
+        max_tokens: Se True, aplica o limite de frases curtas
+
     Returns:
-        Lista formatada de mensagens como ['User: mensagem', 'Assistant: resposta', ...]
+        String com o motivo da interrupção, ou None se a resposta ainda é válida
     """
-    historico_formatado = []
-    
-    for msg in historico:
-        if perspectiva == "comprador":
-            # Para o comprador, o vendedor é o "User" e o comprador é o "Assistant"
-            if msg["role"] == "vendedor":
-                historico_formatado.append(f"User: {msg['content']}")
-            else:
-                historico_formatado.append(f"Assistant: {msg['content']}")
-        else:  # perspectiva = vendedor
-            # Para o vendedor, o comprador é o "User" e o vendedor é o "Assistant"
-            if msg["role"] == "comprador":
-                historico_formatado.append(f"User: {msg['content']}")
-            else:
-                historico_formatado.append(f"Assistant: {msg['content']}")
-    
-    return historico_formatado
+    if tipo_agente != "vendedor":
+        # O comprador não tem formato fixo e não usa o limite de frases curtas
+        return None
+
+    # Mesma abertura tolerada pelo validador: cerca de código, "---" e a linha "Input:"
+    conteudo = PADRAO_ABERTURA.sub("", texto.replace("**", ""), count=1)
+    if conteudo.startswith("```"):
+        # Linha de abertura da cerca ainda incompleta
+        return None
+    if conteudo.startswith(ROTULO_ENTRADA):
+        posicao = conteudo.find(CAMPOS_VENDEDOR[0])
+        if posicao == -1:
+            return None
+        conteudo = conteudo[posicao:]
+
+    # Em seguida a resposta deve começar com "Thought:"
+    inicio = CAMPOS_VENDEDOR[0]
+    # Um texto que ainda é o começo de uma abertura válida ("-", "--", "*") não é abortado
+    inicios_validos = (inicio, ROTULO_ENTRADA, "```", "---", "**")
+    if not any(conteudo.startswith(i) or i.startswith(conteudo) for i in inicios_validos):
+        return f"resposta não começa com '{inicio}'"
+
+    # Os campos devem aparecer na ordem correta
+    posicoes = [conteudo.find(campo) for campo in CAMPOS_VENDEDOR]
+    encontrados = [p for p in posicoes if p != -1]
+    if encontrados != sorted(encontrados):
+        return "campos fora de ordem"
+
+    # Só a FinalResponse está sujeita ao limite de frases
+    posicao_final = posicoes[-1]
+    if posicao_final == -1:
+        return None
+    conteudo = conteudo[posicao_final + len(CAMPOS_VENDEDOR[-1]):]
+
+    if max_tokens:
+        # Conta frases completas; uma nova frase iniciada após o limite já invalida a resposta
+        frases = [f for f in re.split(r"(?<=[.!?])\s+", conteudo.strip()) if re.search(r"\w", f)]
+        if len(frases) > MAX_FRASES_CURTAS:
+            return f"mais de {MAX_FRASES_CURTAS} frases na resposta final"
+
+    return None
+
+def gerar_conteudo_streaming(prompt_completo, generation_config, tipo_agente, max_tokens=None):
+    """
+    Gera o conteúdo em modo streaming, interrompendo a geração assim que a resposta
+    parcial quebra o formato esperado ou o limite de tamanho.
+
+    Returns:
+        Tupla (resposta, motivo) - motivo é None quando a resposta foi concluída
+    """
+    response = obter_modelo().generate_content(
+        prompt_completo,
+        generation_config=generation_config,
+        stream=True
+    )
+
+    texto = ""
+    for chunk in response:
+        texto += chunk.text
+        motivo = verificar_resposta_parcial(texto, tipo_agente, max_tokens)
+        if motivo:
+            # Parar de consumir o iterador cancela o restante da geração
+            return texto, motivo
+
+    return texto.strip(), None
 
 def criar_prompt_sistema(tipo_agente, regras_sistema):
     """
@@ -274,81 +439,107 @@ def criar_prompt_sistema(tipo_agente, regras_sistema):
     """
     return regras_sistema
 
-def criar_prompt_template(historico, mensagem_atual, tipo_agente):
+def montar_prompts(historico, mensagem_atual, tipo_agente, regras_sistema, max_tokens=None):
     """
-    Cria o template de prompt para o usuário no formato exato especificado.
-    
-    Args:
-        historico: Lista formatada de mensagens
-        mensagem_atual: A mensagem mais recente do usuário
-        tipo_agente: "comprador" ou "vendedor"
-        
-    Returns:
-        String com o template de prompt formatado
-    """
-    return f"""<|AgenteAtual|>{tipo_agente}<|AgenteAtual|>
-
-You are a specialized AI assistant. Use the conversation history to provide context and respond to the user's message.
-
-Conversation History:
-{historico}
+    Monta os prompts exatamente como são enviados ao modelo.
 
-Latest User Message:
-{mensagem_atual}"""
-
-def gerar_resposta(historico, mensagem_atual, tipo_agente, regras_sistema, temperatura=0.2, max_tokens=None, max_retries=3):
-    """
-    Gera uma resposta usando o Google Gemini AI com histórico de conversa.
-    Implementa retry com backoff exponencial e cache.
-    
     Returns:
-        Tupla (resposta, sistema_prompt, user_prompt)
+        Tupla (sistema_prompt, user_prompt, prompt_completo)
     """
     # Formata o histórico conforme a perspectiva do agente
     perspectiva = tipo_agente
     historico_formatado = formatar_historico(historico, perspectiva)
-    
+
     # Cria o prompt de sistema (regras)
     sistema_prompt = criar_prompt_sistema(tipo_agente, regras_sistema)
-    
+
     # Adiciona instruções específicas de formatação, se necessário
     if max_tokens:
         sistema_prompt += "\n\nIMPORTANTE: Use no máximo 2 frases curtas na sua resposta."
-    
+
     # Cria o prompt do usuário com o template exato
     user_prompt = criar_prompt_template(historico_formatado, mensagem_atual, tipo_agente)
-    
+
     # Combina os prompts para enviar ao Gemini (já que ele não separa sistema/usuário como o OpenAI)
     prompt_completo = f"{sistema_prompt}\n\n{user_prompt}"
+
+    return sistema_prompt, user_prompt, prompt_completo
+
+def gerar_resposta(historico, mensagem_atual, tipo_agente, regras_sistema, temperatura=0.2, max_tokens=None, max_retries=3, streaming=None, usar_cache=True):
+    """
+    Gera uma resposta usando o Google Gemini AI com histórico de conversa.
+    Implementa retry com backoff exponencial e cache.
+
+    Com usar_cache=False o cache global é ignorado: em execuções longas (pipeline e
+    agendador) ele cresceria sem limite e repetiria conversas inteiras sempre que o mesmo
+    contexto e intenção fossem sorteados de novo.
+
+    No modo streaming (streaming=True ou USAR_STREAMING), a geração é interrompida assim
+    que a resposta quebra o formato ou o limite de frases, e a nova tentativa é imediata.
+
+    Returns:
+        Tupla (resposta, sistema_prompt, user_prompt)
+    """
+    sistema_prompt, user_prompt, prompt_completo = montar_prompts(
+        historico, mensagem_atual, tipo_agente, regras_sistema, max_tokens
+    )
     
     # Verifica se já temos esta resposta em cache
     cache_key = f"{prompt_completo}_{temperatura}_{max_tokens}"
-    if cache_key in resposta_cache:
+    if usar_cache and cache_key in resposta_cache:
         print("Usando resposta do cache...")
         return resposta_cache[cache_key], sistema_prompt, user_prompt
     
+    if streaming is None:
+        streaming = USAR_STREAMING
+
+    # Fora do retry: sem a chave da API o erro deve interromper, não virar fallback
+    obter_modelo()
+
+    # Respostas abortadas no streaming são repetidas sem backoff (não é limite de taxa),
+    # com a temperatura um pouco maior para não repetir a mesma violação
+    abortada = False
+    abortos = 0
+
     # Implementa retry com backoff exponencial
     for attempt in range(max_retries):
         try:
             # Adiciona um pequeno delay para evitar atingir limites de taxa
-            if attempt > 0:
+            if attempt > 0 and not abortada:
                 delay = 2 ** attempt  # Backoff exponencial: 2, 4, 8 segundos
                 print(f"Tentativa {attempt+1}/{max_retries}. Aguardando {delay} segundos...")
                 time.sleep(delay)
-            
-            response = model.generate_content(
-                prompt_completo,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperatura,
-                    candidate_count=1,
-                    max_output_tokens=150 if max_tokens else 500
-                )
+            abortada = False
+
+            generation_config = genai.types.GenerationConfig(
+                temperature=round(min(temperatura + 0.1 * abortos, 1.0), 2),
+                candidate_count=1,
+                max_output_tokens=MAX_TOKENS_SAIDA_CURTA if max_tokens else MAX_TOKENS_SAIDA
             )
-            
-            resposta = response.text.strip()
-            
+
+            if streaming:
+                resposta, motivo = gerar_conteudo_streaming(
+                    prompt_completo, generation_config, tipo_agente, max_tokens
+                )
+                if motivo:
+                    print(f"Geração interrompida na tentativa {attempt+1}: {motivo}")
+                    abortada = True
+                    abortos += 1
+                    if attempt == max_retries - 1:
+                        fallback_response = gerar_resposta_fallback(tipo_agente, mensagem_atual)
+                        return fallback_response, sistema_prompt, user_prompt
+                    continue
+            else:
+                response = obter_modelo().generate_content(
+                    prompt_completo,
+                    generation_config=generation_config
+                )
+
+                resposta = response.text.strip()
+
             # Armazena no cache
-            resposta_cache[cache_key] = resposta
+            if usar_cache:
+                resposta_cache[cache_key] = resposta
             
             return resposta, sistema_prompt, user_prompt
             
@@ -364,57 +555,48 @@ def gerar_resposta(historico, mensagem_atual, tipo_agente, regras_sistema, tempe
     fallback_response = gerar_resposta_fallback(tipo_agente, mensagem_atual)
     return fallback_response, sistema_prompt, user_prompt
 
+def gerar_resposta_vendedor_validada(historico, pergunta, regras_vendedor, temperatura=0.2, usar_cache=True):
+    """
+    Gera a resposta do vendedor e valida a estrutura Thought/ActionInput/NextAgent/FinalResponse.
+    Se a validação falhar, regenera apenas este turno, variando a temperatura
+    (o que também evita reaproveitar a resposta inválida do cache).
+
+    Returns:
+        Tupla (resposta, sistema_prompt, user_prompt)
+    """
+    for regeneracao in range(MAX_REGENERACOES_TURNO + 1):
+        resposta, sistema_prompt, user_prompt = gerar_resposta(
+            historico, pergunta, "vendedor", regras_vendedor,
+            temperatura=round(temperatura + 0.1 * regeneracao, 2), max_tokens=True, usar_cache=usar_cache
+        )
+
+        _, erros = validar_resposta_vendedor(resposta)
+        if not erros:
+            return resposta, sistema_prompt, user_prompt
+
+        print(f"Resposta do vendedor inválida: {'; '.join(erros)}")
+        if regeneracao < MAX_REGENERACOES_TURNO:
+            print(f"Regenerando o turno ({regeneracao + 1}/{MAX_REGENERACOES_TURNO})...")
+
+    print("Não foi possível obter uma resposta válida do vendedor; mantendo a última gerada.")
+    return resposta, sistema_prompt, user_prompt
+
 def gerar_resposta_fallback(tipo_agente, mensagem_atual):
     """
     Gera uma resposta de fallback quando a API falha.
     """
     print("Usando gerador de resposta fallback...")
     
-    # Respostas pré-definidas para o comprador
-    respostas_comprador = [
-        "Qual o preço deste modelo?",
-        "Quais são as opções de cores disponíveis?",
-        "Este carro tem garantia de fábrica?",
-        "Qual o consumo médio de combustível?",
-        "Quais são os itens de série?",
-        "Tem disponibilidade para pronta entrega?",
-        "Quais são as condições de financiamento?",
-        "Este modelo tem câmbio automático?",
-        "Qual a potência do motor?",
-        "Vocês aceitam carro na troca?"
-    ]
-    
-    # Respostas pré-definidas para o vendedor
-    respostas_vendedor = [
-        "O preço deste modelo é R$ 89.990,00 na versão básica.",
-        "Temos disponibilidade nas cores prata, preto, branco e vermelho.",
-        "Sim, o veículo possui 3 anos de garantia de fábrica.",
-        "O consumo médio é de 12 km/l na cidade e 14 km/l na estrada.",
-        "Este modelo vem equipado com ar-condicionado, direção elétrica e central multimídia.",
-        "Temos unidades disponíveis para pronta entrega nas cores prata e branco.",
-        "Oferecemos financiamento em até 60 meses com taxa a partir de 0,99% ao mês.",
-        "Sim, aceitamos seu veículo usado como parte do pagamento após avaliação.",
-        "O motor tem 130 cavalos de potência e torque de 17,5 kgfm.",
-        "A versão top de linha custa R$ 115.990,00 com todos os opcionais."
-    ]
-    
     # Seleciona uma resposta aleatória com base no tipo de agente
     if tipo_agente == "comprador":
-        return random.choice(respostas_comprador)
+        return random.choice(RESPOSTAS_FALLBACK_COMPRADOR)
     else:
-        return random.choice(respostas_vendedor)
+        return random.choice(RESPOSTAS_FALLBACK_VENDEDOR)
 
-def gerar_conversa():
+def preparar_contexto(cenario):
     """
-    Gera uma conversa entre um comprador e um vendedor.
+    Sorteia os parâmetros do cenário (orçamento, modelo, marca...) e preenche o seu contexto.
     """
-    # Seleciona um cenário aleatório
-    cenario = random.choice(CENARIOS_COMPRA)
-    
-    # Seleciona uma intenção aleatória para este cenário
-    intencao = random.choice(cenario["intencoes"])
-    
-    # Prepara o contexto específico do cenário
     if cenario["tipo"] == "orcamento":
         valor = random.choice(cenario["valores"])
         contexto = cenario["contexto"].format(valor=valor)
@@ -448,8 +630,13 @@ def gerar_conversa():
         entrada = random.choice(cenario["entradas"])
         contexto = cenario["contexto"].format(parcela=parcela, entrada=entrada)
 
-    # Define as regras para o comprador
-    regras_comprador = f"""Você é um cliente interessado em comprar um carro.
+    return contexto
+
+def criar_regras_comprador(contexto, intencao):
+    """
+    Cria as regras de sistema do comprador a partir do contexto do cenário e da intenção.
+    """
+    return f"""Você é um cliente interessado em comprar um carro.
     
     {contexto}
     
@@ -463,161 +650,211 @@ def gerar_conversa():
     4. Mantenha o contexto da conversa
     5. Siga uma sequência lógica de perguntas
     6. Suas perguntas devem refletir sua intenção principal"""
-    
-    # Define as regras para o vendedor
-    regras_vendedor = """
-    You are an agent specialized in our car sales system. Your main task is to guide the conversation to collect all the details needed to create a complete listing. The mandatory fields are (**"brand"** or **model**), **"salePrice"**, and **"state"**.
-
-You have access to memory. It contains the conversation history in an array with "User" and "Assistant" entries. Always use the data from memory as the conversation history.
-
-# Main Objectives
-- **Collect information efficiently**: Obtain all necessary details without repeating questions about information already provided.
-- **Extract conversation history**: Analyze the user's input to identify and update the filters: brand, title, year, price. state should be retrieved from memory.
-- **Avoid redundancy**: Only request information that hasn't been provided yet, updating the data based on the current input.
-- **Override older data with newer data**: If the user contradicts or changes previous preferences, update the relevant field(s) with the most recent input.
-
-# Response Format
-Strictly follow this structure (Thought, NextAgent and FinalResponse):
-
----
-Input: The message from the user.  
-Thought: Explain your reasoning clearly and concisely. Justify the next action based on the user's input and details already collected. Highlight why missing details (especially brand, salePrice, or state) are essential. If the user modifies a previously provided field, explain how you override the old data.   
-ActionInput: A JSON object with all parameters collected so far ("brand", "salePrice", "state"...). Use information from the current input and conversation history, but override any conflicting older values with the newest input.  
-NextAgent: "ListingAgent" only when "brand" or "model", "salePrice", and "state" are present; otherwise, leave empty.  
-FinalResponse: "Movendo para o próximo agente" (if brand or model, salePrice, and state are collected) or a polite request in Brazilian Portuguese for missing details (e.g., "Por favor, informe o preço do carro."). Never ask for the "state", always retrieve it from memory.  
----
-
-# Rules
-- **Prioritize the current input**: If the user provides clear information (e.g., "the brand is Chevrolet"), record it in ActionInput immediately, even if the history contains something different (e.g., "Honda"). Use the history only to fill fields not mentioned in the current input.
-- **If the user's new statement conflicts with previously stored data in memory, override the old data in ActionInput with the new statement.**
-- **Avoid unnecessary clarifications**: If the input already answers a mandatory field (brand or model, salePrice, or state), don't question it unless it's contradictory or ambiguous.
-- **Use the model if provided**: Theres no need to ask for the brand if the user already provided the model of the car (e.g. "Onix", "Renegade")
-- **Update ActionInput correctly**: The JSON in ActionInput must always reflect the current state of collected data, combining history and the current input, with priority given to the input in case of conflict.
-- **Request only what's missing**: After updating ActionInput, ask only for the mandatory fields still missing in FinalResponse.
-- **Transition to the next agent**: If "brand" (or "model"), "salePrice", and "state" are filled, set NextAgent to "ListingAgent" and FinalResponse to "Movendo para o próximo agente".
-- **The "state" returned in ActionInput must be a Brazilian state, retrieved from memory, with exactly 2 letters (e.g., "São Paulo" -> "SP").**
-- **Color Must Be Masculine**: If the user provides a color in feminine form (e.g., "preta", "branca", "vermelha"), always convert it to masculine (e.g., "preto", "branco", "vermelho") when storing in ActionInput.
-
-# Response Examples
-
-## Example 1:
-**Input**: O que você tem de Fiat Strada branco de até 50 mil?  
-**Expected Output**:
----
-Thought: The user provided the brand (Fiat), model (Strada), color (branco), and salePrice (50000). I will retrieve the "state" from memory.  
-ActionInput: {"brand": "Fiat", "model": "Strada", "color": "branco", "salePrice": "50000", "state": "RS"}  
-NextAgent: ListingAgent  
-FinalResponse: "Movendo para o próximo agente"  
----
-
-## Example 2:
-**Input**: O que você tem carro com fipe até 40 mil?  
-**Expected Output**:
----
-Thought: The user specified a salePrice limit (40000). I will assume they meant "salePrice" and retrieve brand and state from memory if available. Since this example lacks prior context, I'll request the missing fields.  
-ActionInput: {"salePrice": "40000"}  
-NextAgent:   
-FinalResponse: Por favor, informe os detalhes para que eu possa lhe ajudar.  
----
-
-## Example 3 (Overriding Previous Info):
-**Input**:  
-1) "Estou procurando um Camaro amarelo."  
-2) "Aliás, melhor um preto."  
-**Expected Output after the second input**:
----
-Thought: The user initially gave color "amarelo" but then changed it to "preto." I will override the old color in ActionInput with "preto."   
-ActionInput: {"model": "Camaro", "color": "preto"}  
-NextAgent:   
-FinalResponse: Por favor, informe o preço do carro.  
----
 
-# Implementation Tips
-- If you maintain a conversation history snippet, label it as **"Filtros atuais (dados mais recentes)"** (or similar) before the JSON, to indicate they're subject to change.
-- Analyze the user's input to extract conversation history, but always use the newest input to override conflicting older details.
-- Adapt keywords based on your users' vocabulary (e.g., "used", "new", "value", "cash").
-- Ensure the output strictly follows the defined format, without variations.
-- Always store color in masculine form if the user uses a feminine variant.
-- You only need the brand or the model, dont require both. The model of the car is enought. As well as only the brand.
+def gerar_turnos(conversa_completa, historico_conversa, regras_comprador, turnos, temperatura_comprador=0.2, usar_cache=True):
     """
-    
-    # Histórico de conversa simples (apenas para tracking durante a geração)
-    historico_conversa = []
-    
-    # Histórico completo com prompts e mensagens para salvar
-    conversa_completa = []
-    
-    # Número de turnos de conversa
-    num_turnos = 6
+    Gera os turnos indicados (índices a partir de 0), estendendo a conversa e o histórico recebidos.
 
-    print(f"Gerando {num_turnos} turnos de conversa...")
-    for turno in range(num_turnos):
-        print(f"\nTurno {turno + 1}/{num_turnos}")
+    Args:
+        conversa_completa: ConversaCompacta que recebe as mensagens geradas
+        historico_conversa: Histórico simples da conversa até o momento
+        regras_comprador: Regras de sistema do comprador
+        turnos: Índices dos turnos a gerar (ex.: range(6))
+        temperatura_comprador: Temperatura usada nas perguntas do comprador
+        usar_cache: Se False, as chamadas ignoram o cache global de respostas
+    """
+    for turno in turnos:
+        print(f"\nTurno {turno + 1}/{NUM_TURNOS}")
         
         # Comprador faz uma pergunta
         print("Gerando pergunta do comprador...")
         if turno == 0:
             # Primeira pergunta mais específica
-            mensagem_instrucao = "Faça uma pergunta direta sobre um carro específico que você quer comprar."
+            mensagem_instrucao = INSTRUCAO_PRIMEIRA_PERGUNTA
             # No primeiro turno, não há histórico
             pergunta, sistema_comprador, user_prompt_comprador = gerar_resposta(
-                [], mensagem_instrucao, "comprador", regras_comprador
+                [], mensagem_instrucao, "comprador", regras_comprador, temperatura=temperatura_comprador,
+                usar_cache=usar_cache
             )
         else:
             # Próximas perguntas consideram o histórico da conversa
-            mensagem_instrucao = "Faça uma nova pergunta sobre o mesmo assunto, considerando a resposta anterior do vendedor."
+            mensagem_instrucao = INSTRUCAO_PROXIMA_PERGUNTA
             pergunta, sistema_comprador, user_prompt_comprador = gerar_resposta(
-                historico_conversa, mensagem_instrucao, "comprador", regras_comprador
+                historico_conversa, mensagem_instrucao, "comprador", regras_comprador, temperatura=temperatura_comprador,
+                usar_cache=usar_cache
             )
         
         # Adiciona a pergunta ao histórico de conversa
         historico_conversa.append({"role": "comprador", "content": pergunta})
         
-        # Adiciona todos os detalhes à conversa completa
-        conversa_completa.append({
-            "turno": turno + 1,
-            "agente": "comprador",
-            "sistema_prompt": sistema_comprador,
-            "user_prompt": user_prompt_comprador,
-            "resposta": pergunta
-        })
+        # Adiciona a mensagem à conversa completa (os prompts só são guardados se não forem reconstruíveis)
+        conversa_completa.adicionar(
+            turno + 1, "comprador", pergunta, sistema_comprador, user_prompt_comprador
+        )
         
         print(f"Comprador: {pergunta}")
 
         # Vendedor responde
         print("\nGerando resposta do vendedor...")
-        resposta, sistema_vendedor, user_prompt_vendedor = gerar_resposta(
-            historico_conversa, pergunta, "vendedor", regras_vendedor, max_tokens=True
+        resposta, sistema_vendedor, user_prompt_vendedor = gerar_resposta_vendedor_validada(
+            historico_conversa, pergunta, REGRAS_VENDEDOR, usar_cache=usar_cache
         )
         
         # Adiciona a resposta ao histórico de conversa
         historico_conversa.append({"role": "vendedor", "content": resposta})
         
-        # Adiciona todos os detalhes à conversa completa
-        conversa_completa.append({
-            "turno": turno + 1,
-            "agente": "vendedor",
-            "sistema_prompt": sistema_vendedor,
-            "user_prompt": user_prompt_vendedor,
-            "resposta": resposta
-        })
+        # Adiciona a mensagem à conversa completa
+        conversa_completa.adicionar(
+            turno + 1, "vendedor", resposta, sistema_vendedor, user_prompt_vendedor
+        )
         
         print(f"Vendedor: {resposta}")
 
+def gerar_conversa(cenario=None, intencao=None, contexto=None, usar_cache=True):
+    """
+    Gera uma conversa entre um comprador e um vendedor.
+
+    Args:
+        cenario: Cenário de CENARIOS_COMPRA (sorteado se não informado)
+        intencao: Intenção do comprador (sorteada entre as do cenário se não informada)
+        contexto: Contexto já preenchido do cenário (sorteado com preparar_contexto se não informado)
+        usar_cache: Se False, as chamadas ignoram o cache global de respostas
+    """
+    # Seleciona um cenário aleatório
+    if cenario is None:
+        cenario = random.choice(CENARIOS_COMPRA)
+    
+    # Seleciona uma intenção aleatória para este cenário
+    if intencao is None:
+        intencao = random.choice(cenario["intencoes"])
+    
+    # Prepara o contexto específico do cenário e as regras do comprador
+    if contexto is None:
+        contexto = preparar_contexto(cenario)
+    regras_comprador = criar_regras_comprador(contexto, intencao)
+    
+    # Histórico de conversa simples (apenas para tracking durante a geração)
+    historico_conversa = []
+    
+    # Conversa compacta para salvar (prompts de sistema guardados uma vez por conversa)
+    conversa_completa = ConversaCompacta()
+
+    print(f"Gerando {NUM_TURNOS} turnos de conversa...")
+    gerar_turnos(conversa_completa, historico_conversa, regras_comprador, range(NUM_TURNOS), usar_cache=usar_cache)
+
     # Adiciona um delay entre as conversas para evitar atingir limites de taxa
     print("Conversa gerada com sucesso!")
     time.sleep(1)
 
     return conversa_completa, cenario["tipo"], intencao
 
+def validar_turno_ramificacao(turno_ramificacao):
+    """
+    Garante que o prefixo comum tenha ao menos um turno e deixe ao menos um para os ramos.
+    """
+    if not 0 < turno_ramificacao < NUM_TURNOS:
+        raise ValueError(f"turno_ramificacao deve estar entre 1 e {NUM_TURNOS - 1}")
+
+def gerar_conversas_ramificadas(cenario=None, intencao=None, turno_ramificacao=3, variacoes=None, num_ramos=3,
+                                contexto=None, usar_cache=True):
+    """
+    Gera várias continuações de uma mesma conversa a partir de um prefixo comum.
+
+    Os turnos 1..turno_ramificacao são gerados uma única vez; cada ramo copia esse prefixo
+    e continua até NUM_TURNOS com a sua própria intenção e/ou temperatura do comprador.
+    O prefixo não é pago de novo por ramo (e, se fosse repetido, sairia do cache).
+
+    Args:
+        cenario: Cenário de CENARIOS_COMPRA (sorteado se não informado)
+        intencao: Intenção usada no prefixo (sorteada se não informada)
+        turno_ramificacao: Número de turnos do prefixo comum
+        variacoes: Lista de dicionários {"intencao": ..., "temperatura": ...}, um por ramo;
+            campos ausentes mantêm a intenção do prefixo e a temperatura padrão
+        num_ramos: Usado quando variacoes não é informado: o primeiro ramo segue a intenção
+            original e os demais sorteiam outras intenções do cenário
+        contexto: Contexto já preenchido do cenário (sorteado se não informado)
+        usar_cache: Se False, as chamadas ignoram o cache global de respostas
+
+    Returns:
+        Lista de tuplas (conversa, tipo_cenario, intencao, ramo), uma por ramo
+    """
+    validar_turno_ramificacao(turno_ramificacao)
+
+    if cenario is None:
+        cenario = random.choice(CENARIOS_COMPRA)
+    if intencao is None:
+        intencao = random.choice(cenario["intencoes"])
+
+    if variacoes is None:
+        outras_intencoes = [i for i in cenario["intencoes"] if i != intencao]
+        sorteadas = random.sample(outras_intencoes, min(num_ramos - 1, len(outras_intencoes)))
+        variacoes = [{"intencao": intencao}] + [{"intencao": i} for i in sorteadas]
+
+    # O contexto é sorteado uma vez para que todos os ramos falem do mesmo cenário
+    if contexto is None:
+        contexto = preparar_contexto(cenario)
+
+    print(f"Gerando prefixo comum de {turno_ramificacao} turnos...")
+    prefixo = ConversaCompacta()
+    historico_prefixo = []
+    gerar_turnos(
+        prefixo, historico_prefixo, criar_regras_comprador(contexto, intencao), range(turno_ramificacao),
+        usar_cache=usar_cache
+    )
+
+    ramos = []
+    for num_ramo, variacao in enumerate(variacoes):
+        intencao_ramo = variacao.get("intencao") or intencao
+        temperatura = variacao.get("temperatura", 0.2)
+        print(f"\nRamo {num_ramo + 1}/{len(variacoes)}: {intencao_ramo} (temperatura {temperatura})")
+
+        conversa = prefixo.copiar()
+        gerar_turnos(
+            conversa, list(historico_prefixo), criar_regras_comprador(contexto, intencao_ramo),
+            range(turno_ramificacao, NUM_TURNOS), temperatura_comprador=temperatura, usar_cache=usar_cache
+        )
+        ramo = {
+            "numero": num_ramo,
+            "turno_ramificacao": turno_ramificacao,
+            "intencao_prefixo": intencao,
+            "temperatura_comprador": temperatura
+        }
+        ramos.append((conversa, cenario["tipo"], intencao_ramo, ramo))
+
+    print("Conversas ramificadas geradas com sucesso!")
+    time.sleep(1)
+
+    return ramos
+
+def montar_dados_conversa(conversa, tipo_cenario, intencao, id_conversa, ramo=None):
+    """
+    Cria o objeto salvo para cada conversa: metadados do cenário e a conversa compacta.
+    Conversas ramificadas levam também os dados do ramo (ver gerar_conversas_ramificadas).
+    """
+    metadados = {
+        "tipo_cenario": tipo_cenario,
+        "intencao": intencao,
+        "id": id_conversa
+    }
+    if ramo is not None:
+        metadados["ramo"] = ramo
+
+    return {
+        "metadados": metadados,
+        "conversa": conversa.para_dict()
+    }
+
 def salvar_conversa_completa(conversa, caminho_arquivo):
     """
     Salva a conversa completa em um arquivo JSON.
     
     Args:
-        conversa: Lista completa com prompts e mensagens
+        conversa: ConversaCompacta ou lista completa (formato legado) com prompts e mensagens
         caminho_arquivo: Caminho do arquivo onde a conversa será salva
     """
+    if isinstance(conversa, ConversaCompacta):
+        conversa = conversa.para_dict()
+
     try:
         with open(caminho_arquivo, 'w', encoding='utf-8') as f:
             json.dump(conversa, f, ensure_ascii=False, indent=4)
@@ -631,6 +868,10 @@ if __name__ == "__main__":
     
     # Lista de todos os tipos de cenários disponíveis
     tipos_cenarios = [cenario["tipo"] for cenario in CENARIOS_COMPRA]
+
+    # Falha logo no início se a chave da API não estiver configurada
+    obter_modelo()
+
     print(f"Iniciando geração de conversas para {len(tipos_cenarios)} tipos de cenários...")
     
     # Dicionário para armazenar todas as conversas
@@ -661,121 +902,8 @@ if __name__ == "__main__":
             try:
                 print(f"Tentativa {tentativas}/{max_tentativas_por_cenario} para o cenário {tipo_cenario}")
                 
-                # Prepara o contexto específico do cenário
-                if tipo_cenario == "orcamento":
-                    valor = random.choice(cenario["valores"])
-                    contexto = cenario["contexto"].format(valor=valor)
-                elif tipo_cenario == "carro_especifico":
-                    modelo, ano = random.choice(cenario["modelos"])
-                    contexto = cenario["contexto"].format(modelo=modelo, ano=ano)
-                elif tipo_cenario == "marca_especifica":
-                    marca = random.choice(cenario["marcas"])
-                    contexto = cenario["contexto"].format(marca=marca)
-                elif tipo_cenario == "categoria":
-                    categoria = random.choice(cenario["categorias"])
-                    valor = random.choice(cenario["valores"])
-                    contexto = cenario["contexto"].format(categoria=categoria, valor=valor)
-                elif tipo_cenario == "primeira_compra":
-                    valor = random.choice(cenario["valores"])
-                    contexto = cenario["contexto"].format(valor=valor)
-                elif tipo_cenario == "familia":
-                    tamanho = random.choice(cenario["tamanhos"])
-                    valor = random.choice(cenario["valores"])
-                    contexto = cenario["contexto"].format(tamanho=tamanho, valor=valor)
-                elif tipo_cenario == "troca":
-                    carro_atual, ano_atual = random.choice(cenario["carros_atuais"])
-                    valor = random.choice(cenario["valores"])
-                    contexto = cenario["contexto"].format(carro_atual=carro_atual, ano_atual=ano_atual, valor=valor)
-                elif tipo_cenario == "uso_especifico":
-                    uso = random.choice(cenario["usos"])
-                    valor = random.choice(cenario["valores"])
-                    contexto = cenario["contexto"].format(uso=uso, valor=valor)
-                elif tipo_cenario == "financiamento":
-                    parcela = random.choice(cenario["parcelas"])
-                    entrada = random.choice(cenario["entradas"])
-                    contexto = cenario["contexto"].format(parcela=parcela, entrada=entrada)
-                
-                # Define as regras para o comprador
-                regras_comprador = f"""Você é um cliente interessado em comprar um carro.
-                
-                {contexto}
-                
-                SUA INTENÇÃO PRINCIPAL:
-                {intencao}
-                
-                REGRAS OBRIGATÓRIAS:
-                1. Faça APENAS UMA pergunta por vez
-                2. Seja direto e objetivo
-                3. Use português formal
-                4. Mantenha o contexto da conversa
-                5. Siga uma sequência lógica de perguntas
-                6. Suas perguntas devem refletir sua intenção principal"""
-                
-                # Define as regras para o vendedor (mantém as mesmas)
-                regras_vendedor = """
-                You are an agent specialized in our car sales system...
-                """  # Mantém o resto do prompt do vendedor
-                
                 # Gera a conversa
-                historico_conversa = []
-                conversa_completa = []
-                
-                # Número de turnos de conversa
-                num_turnos = 6
-                
-                print(f"Gerando {num_turnos} turnos de conversa...")
-                for turno in range(num_turnos):
-                    print(f"\nTurno {turno + 1}/{num_turnos}")
-                    
-                    # Comprador faz uma pergunta
-                    print("Gerando pergunta do comprador...")
-                    if turno == 0:
-                        # Primeira pergunta mais específica
-                        mensagem_instrucao = "Faça uma pergunta direta sobre um carro específico que você quer comprar."
-                        # No primeiro turno, não há histórico
-                        pergunta, sistema_comprador, user_prompt_comprador = gerar_resposta(
-                            [], mensagem_instrucao, "comprador", regras_comprador
-                        )
-                    else:
-                        # Próximas perguntas consideram o histórico da conversa
-                        mensagem_instrucao = "Faça uma nova pergunta sobre o mesmo assunto, considerando a resposta anterior do vendedor."
-                        pergunta, sistema_comprador, user_prompt_comprador = gerar_resposta(
-                            historico_conversa, mensagem_instrucao, "comprador", regras_comprador
-                        )
-                    
-                    # Adiciona a pergunta ao histórico de conversa
-                    historico_conversa.append({"role": "comprador", "content": pergunta})
-                    
-                    # Adiciona todos os detalhes à conversa completa
-                    conversa_completa.append({
-                        "turno": turno + 1,
-                        "agente": "comprador",
-                        "sistema_prompt": sistema_comprador,
-                        "user_prompt": user_prompt_comprador,
-                        "resposta": pergunta
-                    })
-                    
-                    print(f"Comprador: {pergunta}")
-                    
-                    # Vendedor responde
-                    print("\nGerando resposta do vendedor...")
-                    resposta, sistema_vendedor, user_prompt_vendedor = gerar_resposta(
-                        historico_conversa, pergunta, "vendedor", regras_vendedor, max_tokens=True
-                    )
-                    
-                    # Adiciona a resposta ao histórico de conversa
-                    historico_conversa.append({"role": "vendedor", "content": resposta})
-                    
-                    # Adiciona todos os detalhes à conversa completa
-                    conversa_completa.append({
-                        "turno": turno + 1,
-                        "agente": "vendedor",
-                        "sistema_prompt": sistema_vendedor,
-                        "user_prompt": user_prompt_vendedor,
-                        "resposta": resposta
-                    })
-                    
-                    print(f"Vendedor: {resposta}")
+                conversa_completa, _, _ = gerar_conversa(cenario, intencao)
                 
                 # Verifica se a conversa tem conteúdo válido
                 if len(conversa_completa) < 2:
@@ -784,14 +912,9 @@ if __name__ == "__main__":
                     continue
                 
                 # Cria um objeto com metadados e a conversa
-                dados_completos = {
-                    "metadados": {
-                        "tipo_cenario": tipo_cenario,
-                        "intencao": intencao,
-                        "id": f"{tipo_cenario}_1"
-                    },
-                    "conversa": conversa_completa
-                }
+                dados_completos = montar_dados_conversa(
+                    conversa_completa, tipo_cenario, intencao, f"{tipo_cenario}_1"
+                )
                 
                 # Adiciona a conversa ao dicionário de todas as conversas
                 todas_conversas[tipo_cenario] = dados_completos
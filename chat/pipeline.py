@@ -0,0 +1,339 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+
+from main import (
+    CENARIOS_COMPRA, obter_modelo, preparar_contexto, gerar_conversa, gerar_conversas_ramificadas, montar_dados_conversa,
+    validar_turno_ramificacao, NUM_TURNOS
+)
+from agendador import executar_agendador
+import planejador
+from validador import validar_resposta_vendedor
+
+# O conversor fica em create_dataset/, fora do pacote do chat
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'create_dataset'))
+from converter import build_records, JsonlShardWriter
+
+# Marca o fim da produção de um gerador na fila
+FIM = None
+
+PADRAO_SHARD = re.compile(r"shard-(\d+)\.jsonl")
+
+# Sorteios tentados por conversa antes de aceitar um (contexto, intenção) já usado no cenário
+MAX_SORTEIOS_PLANO = 200
+
+def gerar_plano(num_conversas):
+    """
+    Distribui as conversas entre os cenários em rodízio e sorteia o contexto e a intenção
+    de cada uma, evitando as combinações já usadas no mesmo cenário. Quando elas se
+    esgotam (ou não aparecem em MAX_SORTEIOS_PLANO sorteios), o ciclo do cenário recomeça.
+
+    Yields:
+        Tuplas (numero, cenario, intencao, contexto)
+    """
+    usadas = {}
+    cenarios = itertools.islice(itertools.cycle(CENARIOS_COMPRA), num_conversas)
+    for numero, cenario in enumerate(cenarios, start=1):
+        usadas_cenario = usadas.setdefault(cenario["tipo"], set())
+        for _ in range(MAX_SORTEIOS_PLANO):
+            contexto = preparar_contexto(cenario)
+            intencao = random.choice(cenario["intencoes"])
+            if (contexto, intencao) not in usadas_cenario:
+                break
+        else:
+            usadas_cenario.clear()
+        usadas_cenario.add((contexto, intencao))
+        yield numero, cenario, intencao, contexto
+
+def produzir(plano, lock_plano, fila, turno_ramificacao=None, num_ramos=1):
+    """
+    Gera conversas do plano e as coloca na fila. A fila é limitada, então o gerador
+    fica bloqueado (backpressure) enquanto a conversão não consumir as anteriores.
+
+    Com turno_ramificacao, cada item do plano gera num_ramos conversas que compartilham
+    os primeiros turno_ramificacao turnos (ver gerar_conversas_ramificadas).
+
+    O cache global de respostas não é usado: a execução pode ser longa e cada conversa
+    deve ser gerada de fato, e não repetida de uma anterior com o mesmo sorteio.
+    """
+    try:
+        while True:
+            with lock_plano:
+                proximo = next(plano, None)
+            if proximo is None:
+                break
+
+            numero, cenario, intencao, contexto = proximo
+            try:
+                if turno_ramificacao is not None:
+                    ramos = gerar_conversas_ramificadas(
+                        cenario, intencao, turno_ramificacao=turno_ramificacao, num_ramos=num_ramos,
+                        contexto=contexto, usar_cache=False
+                    )
+                else:
+                    conversa, tipo_cenario, intencao = gerar_conversa(
+                        cenario, intencao, contexto=contexto, usar_cache=False
+                    )
+                    ramos = [(conversa, tipo_cenario, intencao, None)]
+            except Exception as e:
+                print(f"Erro ao gerar a conversa {numero} ({cenario['tipo']}): {str(e)}")
+                continue
+
+            for conversa, tipo_cenario, intencao, ramo in ramos:
+                if len(conversa) < 2:
+                    print(f"Conversa {numero} inválida ou muito curta. Descartando...")
+                    continue
+
+                id_conversa = f"{tipo_cenario}_{numero}"
+                if ramo is not None:
+                    id_conversa += f"_r{ramo['numero']}"
+                fila.put(montar_dados_conversa(conversa, tipo_cenario, intencao, id_conversa, ramo))
+    finally:
+        fila.put(FIM)
+
+def produzir_com_agendador(plano, fila, num_trabalhadores, max_em_andamento):
+    """
+    Gera as conversas do plano intercaladas pelo agendador (ver agendador.py) e coloca
+    cada conversa concluída na fila. Com a fila cheia, o agendador para de despachar
+    novas requisições até a conversão liberar espaço.
+    """
+    def ao_concluir(estado):
+        tipo_cenario = estado.cenario["tipo"]
+        fila.put(montar_dados_conversa(
+            estado.conversa, tipo_cenario, estado.intencao, f"{tipo_cenario}_{estado.numero}"
+        ))
+
+    try:
+        executar_agendador(plano, ao_concluir, num_trabalhadores, max_em_andamento)
+    finally:
+        fila.put(FIM)
+
+class EscritorShards:
+    """
+    Escreve os registros ShareGPT em shards JSONL numerados, trocando de shard a cada
+    `registros_por_shard` registros. O índice de cada shard é gravado quando ele é fechado.
+    A numeração continua após o maior shard já existente no diretório, então uma nova
+    execução acrescenta shards (como em conversas.jsonl) em vez de sobrescrever os anteriores.
+    """
+
+    def __init__(self, diretorio, registros_por_shard):
+        self.diretorio = diretorio
+        self.registros_por_shard = registros_por_shard
+        self.num_shard = 0
+        for nome in os.listdir(diretorio):
+            encontrado = PADRAO_SHARD.fullmatch(nome)
+            if encontrado:
+                self.num_shard = max(self.num_shard, int(encontrado.group(1)) + 1)
+        self.writer = None
+
+    def escrever(self, registro, tipo_cenario, turno=None):
+        if self.writer is None or self.writer.count >= self.registros_por_shard:
+            self.fechar()
+            caminho = os.path.join(self.diretorio, f"shard-{self.num_shard:05d}.jsonl")
+            self.writer = JsonlShardWriter(caminho)
+            self.num_shard += 1
+        self.writer.write(registro, tipo_cenario, turno)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def fechar(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def executar_pipeline(num_conversas, diretorio_saida, tamanho_fila=8, num_geradores=1,
+                      registros_por_shard=10000, validar=True, deduplicar=True, salvar_conversas=False,
+                      turno_ramificacao=None, num_ramos=1, agendador=False, num_trabalhadores=32,
+                      max_em_andamento=1000, score_minimo=None):
+    """
+    Gera conversas e as converte para ShareGPT JSONL no mesmo processo, sem o arquivo
+    JSON intermediário: os geradores alimentam uma fila limitada e a conversão grava os
+    registros nos shards assim que cada conversa termina.
+
+    Args:
+        num_conversas: Número total de conversas a gerar
+        diretorio_saida: Diretório dos shards JSONL
+        tamanho_fila: Máximo de conversas prontas aguardando conversão
+        num_geradores: Número de threads gerando conversas em paralelo
+        registros_por_shard: Registros por shard antes de abrir o próximo
+        validar: Descarta turnos cuja resposta do vendedor não passa na validação
+        deduplicar: Descarta turnos com pergunta e resposta já vistas
+        salvar_conversas: Também grava as conversas brutas em conversas.jsonl
+        turno_ramificacao: Se informado, cada conversa do plano é ramificada após este turno
+        num_ramos: Número de ramos por conversa ramificada
+        agendador: Intercala todas as conversas em um único agendador em vez de usar
+            num_geradores threads gerando uma conversa de cada vez (não combina com ramificação)
+        num_trabalhadores: Requisições simultâneas ao modelo no modo agendador
+        max_em_andamento: Conversas abertas ao mesmo tempo no modo agendador
+        score_minimo: Descarta turnos com score de qualidade abaixo deste valor (ver create_dataset/scoring.py)
+
+    Returns:
+        Dicionário com as contagens de conversas e registros
+    """
+    if agendador and turno_ramificacao is not None:
+        raise ValueError("O modo agendador não suporta conversas ramificadas.")
+    if turno_ramificacao is not None:
+        validar_turno_ramificacao(turno_ramificacao)
+
+    # Falha antes de iniciar os geradores se a chave da API não estiver configurada
+    obter_modelo()
+
+    os.makedirs(diretorio_saida, exist_ok=True)
+
+    fila = queue.Queue(maxsize=tamanho_fila)
+    plano = gerar_plano(num_conversas)
+    if agendador:
+        num_geradores = 1
+        geradores = [threading.Thread(
+            target=produzir_com_agendador, args=(plano, fila, num_trabalhadores, max_em_andamento), daemon=True
+        )]
+    else:
+        lock_plano = threading.Lock()
+        geradores = [
+            threading.Thread(
+                target=produzir, args=(plano, lock_plano, fila, turno_ramificacao, num_ramos), daemon=True
+            )
+            for _ in range(num_geradores)
+        ]
+    for gerador in geradores:
+        gerador.start()
+
+    escritor = EscritorShards(diretorio_saida, registros_por_shard)
+    arquivo_conversas = None
+    if salvar_conversas:
+        arquivo_conversas = open(os.path.join(diretorio_saida, "conversas.jsonl"), 'a', encoding='utf-8')
+
+    vistos = set()
+    estatisticas = {"conversas": 0, "registros": 0, "invalidos": 0, "duplicados": 0, "baixa_qualidade": 0}
+    geradores_ativos = num_geradores
+
+    try:
+        while geradores_ativos:
+            dados = fila.get()
+            if dados is FIM:
+                geradores_ativos -= 1
+                continue
+
+            estatisticas["conversas"] += 1
+            if arquivo_conversas:
+                arquivo_conversas.write(json.dumps(dados, ensure_ascii=False) + '\n')
+
+            for registro, tipo_cenario, turno in build_records(dados):
+                mensagens = {msg["from"]: msg["value"] for msg in registro["conversations"]}
+
+                if validar:
+                    _, erros = validar_resposta_vendedor(mensagens["gpt"])
+                    if erros:
+                        estatisticas["invalidos"] += 1
+                        continue
+
+                if score_minimo is not None and registro["score"] < score_minimo:
+                    estatisticas["baixa_qualidade"] += 1
+                    continue
+
+                if deduplicar:
+                    chave = hashlib.sha1(f"{mensagens['human']}\0{mensagens['gpt']}".encode('utf-8')).digest()
+                    if chave in vistos:
+                        estatisticas["duplicados"] += 1
+                        continue
+                    vistos.add(chave)
+
+                escritor.escrever(registro, tipo_cenario, turno)
+                estatisticas["registros"] += 1
+
+            # Deixa os registros visíveis para leitores enquanto a geração continua
+            escritor.flush()
+            if arquivo_conversas:
+                arquivo_conversas.flush()
+
+            print(f"Pipeline: {estatisticas['conversas']} conversas, "
+                  f"{estatisticas['registros']} registros gravados")
+    finally:
+        escritor.fechar()
+        if arquivo_conversas:
+            arquivo_conversas.close()
+
+    return estatisticas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera conversas e grava shards ShareGPT JSONL em um único passo")
+    parser.add_argument("--conversas", type=int, default=len(CENARIOS_COMPRA),
+                        help="número de conversas (padrão: uma por cenário)")
+    parser.add_argument("--saida", default="dataset", help="diretório dos shards")
+    parser.add_argument("--fila", type=int, default=8, help="conversas aguardando conversão antes de bloquear os geradores")
+    parser.add_argument("--geradores", type=int, default=1, help="threads gerando conversas em paralelo")
+    parser.add_argument("--registros-por-shard", type=int, default=10000)
+    parser.add_argument("--sem-validacao", action="store_true", help="não descarta respostas inválidas do vendedor")
+    parser.add_argument("--sem-deduplicacao", action="store_true", help="não descarta turnos repetidos")
+    parser.add_argument("--score-minimo", type=float, default=None,
+                        help="descarta turnos com score de qualidade abaixo deste valor (0 a 5)")
+    parser.add_argument("--salvar-conversas", action="store_true", help="grava também as conversas brutas")
+    parser.add_argument("--ramificar-no-turno", type=int, default=None,
+                        help="gera vários ramos de cada conversa a partir deste turno")
+    parser.add_argument("--ramos", type=int, default=3, help="ramos por conversa ramificada")
+    parser.add_argument("--agendador", action="store_true",
+                        help="intercala as conversas em um agendador de turnos compartilhado")
+    parser.add_argument("--trabalhadores", type=int, default=32, help="requisições simultâneas no modo agendador")
+    parser.add_argument("--em-andamento", type=int, default=1000, help="conversas abertas ao mesmo tempo no modo agendador")
+    parser.add_argument("--plano", "--dry-run", dest="plano", action="store_true",
+                        help="apenas estima chamadas, tokens, custo e tempo, sem chamar o modelo")
+    parser.add_argument("--tokens-pergunta", type=int, default=30, help="tamanho simulado das perguntas no --plano")
+    parser.add_argument("--tokens-resposta", type=int, default=120, help="tamanho simulado das respostas no --plano")
+    parser.add_argument("--rpm", type=int, default=planejador.REQUISICOES_POR_MINUTO, help="limite de requisições por minuto")
+    parser.add_argument("--tpm", type=int, default=planejador.TOKENS_POR_MINUTO, help="limite de tokens de entrada por minuto")
+    parser.add_argument("--latencia", type=float, default=planejador.LATENCIA_MEDIA, help="latência média por chamada (s)")
+    args = parser.parse_args()
+
+    if args.agendador and args.ramificar_no_turno is not None:
+        parser.error("--agendador não pode ser usado com --ramificar-no-turno")
+    if args.ramificar_no_turno is not None:
+        try:
+            validar_turno_ramificacao(args.ramificar_no_turno)
+        except ValueError:
+            parser.error(f"--ramificar-no-turno deve estar entre 1 e {NUM_TURNOS - 1}")
+
+    if args.plano:
+        planejamento = planejador.planejar_execucao(
+            gerar_plano(args.conversas), args.tokens_pergunta, args.tokens_resposta,
+            turno_ramificacao=args.ramificar_no_turno, num_ramos=args.ramos
+        )
+        tempo_estimado = planejador.estimar_tempo(
+            planejamento,
+            concorrencia=args.trabalhadores if args.agendador else args.geradores,
+            requisicoes_por_minuto=args.rpm,
+            tokens_por_minuto=args.tpm,
+            latencia_media=args.latencia,
+            # gerar_conversa faz uma pausa de 1 segundo ao fim de cada conversa
+            pausa_por_conversa=0 if args.agendador else 1
+        )
+        planejador.imprimir_relatorio(planejamento, tempo_estimado)
+        sys.exit(0)
+
+    estatisticas = executar_pipeline(
+        args.conversas, args.saida,
+        tamanho_fila=args.fila,
+        num_geradores=args.geradores,
+        registros_por_shard=args.registros_por_shard,
+        validar=not args.sem_validacao,
+        deduplicar=not args.sem_deduplicacao,
+        salvar_conversas=args.salvar_conversas,
+        turno_ramificacao=args.ramificar_no_turno,
+        num_ramos=args.ramos,
+        agendador=args.agendador,
+        num_trabalhadores=args.trabalhadores,
+        max_em_andamento=args.em_andamento,
+        score_minimo=args.score_minimo
+    )
+
+    print(f"\nPipeline concluído! {estatisticas['conversas']} conversas, {estatisticas['registros']} registros gravados "
+          f"({estatisticas['invalidos']} inválidos, {estatisticas['baixa_qualidade']} com score baixo e "
+          f"{estatisticas['duplicados']} duplicados descartados).")
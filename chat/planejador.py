@@ -0,0 +1,163 @@
+import random
+
+from main import (
+    NUM_TURNOS, REGRAS_VENDEDOR, MAX_TOKENS_SAIDA, MAX_TOKENS_SAIDA_CURTA,
+    montar_prompts, criar_regras_comprador, validar_turno_ramificacao
+)
+from utils import INSTRUCAO_PRIMEIRA_PERGUNTA, INSTRUCAO_PROXIMA_PERGUNTA
+
+# Estimativa local de tokens: média de caracteres por token do tokenizador do Gemini
+CARACTERES_POR_TOKEN = 4
+
+# Preço do gemini-2.0-flash em dólares por milhão de tokens (confira a tabela atual antes de usar)
+PRECO_ENTRADA_POR_MILHAO = 0.10
+PRECO_SAIDA_POR_MILHAO = 0.40
+
+# Limites da API (requisições e tokens de entrada por minuto, nível pago 1) e latência média por chamada
+REQUISICOES_POR_MINUTO = 2000
+TOKENS_POR_MINUTO = 4000000
+LATENCIA_MEDIA = 2.0
+
+def contar_tokens(texto):
+    """
+    Estima o número de tokens de um texto sem chamar a API.
+    """
+    return max(1, round(len(texto) / CARACTERES_POR_TOKEN))
+
+def resposta_simulada(num_tokens):
+    """
+    Texto de tamanho equivalente a num_tokens, usado no lugar das respostas do modelo.
+    """
+    return "x" * (num_tokens * CARACTERES_POR_TOKEN)
+
+class Planejamento:
+    """
+    Acumula chamadas e tokens previstos, por cenário e por agente.
+    """
+
+    def __init__(self):
+        self.por_cenario = {}
+        self.por_agente = {}
+        self.conversas = 0
+
+    def registrar(self, tipo_cenario, agente, prompt, tokens_saida):
+        tokens_entrada = contar_tokens(prompt)
+        for grupo, chave in ((self.por_cenario, tipo_cenario), (self.por_agente, agente)):
+            totais = grupo.setdefault(chave, {"chamadas": 0, "tokens_entrada": 0, "tokens_saida": 0})
+            totais["chamadas"] += 1
+            totais["tokens_entrada"] += tokens_entrada
+            totais["tokens_saida"] += tokens_saida
+
+    def total(self, campo):
+        return sum(totais[campo] for totais in self.por_agente.values())
+
+def simular_turnos(planejamento, tipo_cenario, historico, regras_comprador, turnos, tokens_pergunta, tokens_resposta):
+    """
+    Monta os prompts dos turnos indicados como gerar_turnos faria, usando respostas
+    simuladas de tamanho fixo, e registra cada chamada no planejamento.
+    """
+    tokens_pergunta = min(tokens_pergunta, MAX_TOKENS_SAIDA)
+    tokens_resposta = min(tokens_resposta, MAX_TOKENS_SAIDA_CURTA)
+
+    for turno in turnos:
+        instrucao = INSTRUCAO_PRIMEIRA_PERGUNTA if turno == 0 else INSTRUCAO_PROXIMA_PERGUNTA
+        _, _, prompt = montar_prompts(historico if turno else [], instrucao, "comprador", regras_comprador)
+        planejamento.registrar(tipo_cenario, "comprador", prompt, tokens_pergunta)
+        pergunta = resposta_simulada(tokens_pergunta)
+        historico.append({"role": "comprador", "content": pergunta})
+
+        _, _, prompt = montar_prompts(historico, pergunta, "vendedor", REGRAS_VENDEDOR, max_tokens=True)
+        planejamento.registrar(tipo_cenario, "vendedor", prompt, tokens_resposta)
+        historico.append({"role": "vendedor", "content": resposta_simulada(tokens_resposta)})
+
+def planejar_execucao(plano, tokens_pergunta=30, tokens_resposta=120, turno_ramificacao=None, num_ramos=1):
+    """
+    Simula a execução sem chamar o modelo: monta todos os prompts que seriam enviados,
+    com o mesmo sorteio de cenários, e conta os tokens localmente.
+    Não considera regenerações, novas tentativas nem respostas servidas pelo cache.
+
+    Args:
+        plano: Iterável de (numero, cenario, intencao, contexto) com as conversas a gerar
+            (ver pipeline.gerar_plano)
+        tokens_pergunta: Tamanho simulado de cada pergunta do comprador
+        tokens_resposta: Tamanho simulado de cada resposta do vendedor
+        turno_ramificacao: Se informado, simula num_ramos ramos por conversa a partir deste turno
+
+    Returns:
+        Planejamento com os totais previstos
+    """
+    if turno_ramificacao is not None:
+        validar_turno_ramificacao(turno_ramificacao)
+
+    planejamento = Planejamento()
+    for _, cenario, intencao, contexto in plano:
+        # O plano já traz o sorteio de contexto e intenção usado na geração real
+        tipo_cenario = cenario["tipo"]
+
+        if turno_ramificacao is None:
+            simular_turnos(
+                planejamento, tipo_cenario, [], criar_regras_comprador(contexto, intencao),
+                range(NUM_TURNOS), tokens_pergunta, tokens_resposta
+            )
+            planejamento.conversas += 1
+            continue
+
+        # O prefixo é gerado uma vez; cada ramo paga apenas os turnos seguintes
+        historico_prefixo = []
+        simular_turnos(
+            planejamento, tipo_cenario, historico_prefixo, criar_regras_comprador(contexto, intencao),
+            range(turno_ramificacao), tokens_pergunta, tokens_resposta
+        )
+        outras_intencoes = [i for i in cenario["intencoes"] if i != intencao]
+        intencoes_ramos = [intencao] + random.sample(outras_intencoes, min(num_ramos - 1, len(outras_intencoes)))
+        for intencao_ramo in intencoes_ramos:
+            simular_turnos(
+                planejamento, tipo_cenario, list(historico_prefixo), criar_regras_comprador(contexto, intencao_ramo),
+                range(turno_ramificacao, NUM_TURNOS), tokens_pergunta, tokens_resposta
+            )
+            planejamento.conversas += 1
+
+    return planejamento
+
+def estimar_tempo(planejamento, concorrencia=1, requisicoes_por_minuto=REQUISICOES_POR_MINUTO,
+                  tokens_por_minuto=TOKENS_POR_MINUTO, latencia_media=LATENCIA_MEDIA, pausa_por_conversa=0):
+    """
+    Estima o tempo total em segundos: o maior entre o limite de requisições, o limite de
+    tokens de entrada e a latência das chamadas dividida pela concorrência.
+    """
+    chamadas = planejamento.total("chamadas")
+    tempo_latencia = (chamadas * latencia_media + planejamento.conversas * pausa_por_conversa) / concorrencia
+    return max(
+        chamadas / requisicoes_por_minuto * 60,
+        planejamento.total("tokens_entrada") / tokens_por_minuto * 60,
+        tempo_latencia
+    )
+
+def formatar_duracao(segundos):
+    horas, resto = divmod(int(round(segundos)), 3600)
+    minutos, segundos = divmod(resto, 60)
+    return f"{horas}h{minutos:02d}m{segundos:02d}s"
+
+def imprimir_relatorio(planejamento, tempo_estimado):
+    def custo(totais):
+        return (totais["tokens_entrada"] * PRECO_ENTRADA_POR_MILHAO
+                + totais["tokens_saida"] * PRECO_SAIDA_POR_MILHAO) / 1_000_000
+
+    def linhas(grupo):
+        for chave, totais in sorted(grupo.items()):
+            print(f"  {chave:<20} {totais['chamadas']:>10} {totais['tokens_entrada']:>15} "
+                  f"{totais['tokens_saida']:>13} {custo(totais):>10.2f}")
+
+    cabecalho = f"  {'':<20} {'chamadas':>10} {'tokens entrada':>15} {'tokens saída':>13} {'US$':>10}"
+    print(f"\nPlanejamento (simulação, nenhuma chamada foi feita): {planejamento.conversas} conversas")
+    print("\nPor cenário:")
+    print(cabecalho)
+    linhas(planejamento.por_cenario)
+    print("\nPor agente:")
+    print(cabecalho)
+    linhas(planejamento.por_agente)
+
+    totais = {campo: planejamento.total(campo) for campo in ("chamadas", "tokens_entrada", "tokens_saida")}
+    print(f"\nTotal: {totais['chamadas']} chamadas, {totais['tokens_entrada']} tokens de entrada, "
+          f"{totais['tokens_saida']} tokens de saída, US$ {custo(totais):.2f}")
+    print(f"Tempo estimado: {formatar_duracao(tempo_estimado)}")
@@ -0,0 +1,157 @@
+import sys
+
+from utils import (
+    formatar_historico, criar_prompt_template,
+    INSTRUCAO_PRIMEIRA_PERGUNTA, INSTRUCAO_PROXIMA_PERGUNTA
+)
+
+# Identifica o formato compacto no JSON salvo (o formato legado é uma lista de mensagens)
+FORMATO_COMPACTO = "compacto"
+
+class Turno:
+    """
+    Uma mensagem da conversa. Os prompts só são guardados quando diferem dos
+    reconstruídos a partir da conversa (registros legados editados, ou ramos de uma
+    conversa ramificada que usam outras regras para o comprador).
+    """
+    __slots__ = ("turno", "agente", "resposta", "sistema_prompt", "user_prompt")
+
+    def __init__(self, turno, agente, resposta, sistema_prompt=None, user_prompt=None):
+        self.turno = turno
+        self.agente = agente
+        self.resposta = resposta
+        self.sistema_prompt = sistema_prompt
+        self.user_prompt = user_prompt
+
+    def para_dict(self):
+        dados = {"turno": self.turno, "agente": self.agente, "resposta": self.resposta}
+        if self.sistema_prompt is not None:
+            dados["sistema_prompt"] = self.sistema_prompt
+        if self.user_prompt is not None:
+            dados["user_prompt"] = self.user_prompt
+        return dados
+
+class ConversaCompacta:
+    """
+    Conversa em formato compacto: o prompt de sistema de cada agente é guardado uma
+    única vez (internado, compartilhado entre conversas) e os prompts do usuário são
+    reconstruídos a partir do histórico em vez de armazenados em cada mensagem.
+    """
+    __slots__ = ("sistemas", "turnos")
+
+    def __init__(self, sistemas=None, turnos=None):
+        self.sistemas = sistemas if sistemas is not None else {}
+        self.turnos = turnos if turnos is not None else []
+
+    def __len__(self):
+        return len(self.turnos)
+
+    def copiar(self):
+        """
+        Cópia para continuar a conversa por outro caminho; os turnos já gerados são compartilhados.
+        """
+        return ConversaCompacta(dict(self.sistemas), list(self.turnos))
+
+    def adicionar(self, turno, agente, resposta, sistema_prompt, user_prompt):
+        """
+        Adiciona uma mensagem, guardando os prompts apenas se não puderem ser reconstruídos.
+        """
+        sistema_prompt = sys.intern(sistema_prompt)
+        sistema_salvo = self.sistemas.setdefault(agente, sistema_prompt)
+
+        novo = Turno(turno, agente, resposta)
+        if sistema_prompt is not sistema_salvo:
+            novo.sistema_prompt = sistema_prompt
+        if user_prompt != self._reconstruir_user_prompt(len(self.turnos), agente, self.historico()):
+            novo.user_prompt = user_prompt
+
+        self.turnos.append(novo)
+        return novo
+
+    def historico(self, ate=None):
+        """
+        Retorna o histórico simples ({"role", "content"}) das mensagens anteriores ao índice `ate`.
+        """
+        return [{"role": t.agente, "content": t.resposta} for t in self.turnos[:ate]]
+
+    def _reconstruir_user_prompt(self, indice, agente, historico):
+        if agente == "comprador":
+            mensagem_atual = INSTRUCAO_PRIMEIRA_PERGUNTA if indice == 0 else INSTRUCAO_PROXIMA_PERGUNTA
+        else:
+            # O vendedor responde à última pergunta do comprador, que já faz parte do histórico;
+            # sem ela (registros legados fora de ordem ou incompletos) o prompt não é reconstruível
+            if indice == 0 or self.turnos[indice - 1].agente != "comprador":
+                return None
+            mensagem_atual = self.turnos[indice - 1].resposta
+        return criar_prompt_template(formatar_historico(historico, agente), mensagem_atual, agente)
+
+    def sistema_prompt(self, indice):
+        turno = self.turnos[indice]
+        if turno.sistema_prompt is not None:
+            return turno.sistema_prompt
+        return self.sistemas[turno.agente]
+
+    def user_prompt(self, indice):
+        turno = self.turnos[indice]
+        if turno.user_prompt is not None:
+            return turno.user_prompt
+        return self._reconstruir_user_prompt(indice, turno.agente, self.historico(indice))
+
+    def expandir(self):
+        """
+        Reconstrói a lista no formato legado, com sistema_prompt e user_prompt em cada mensagem.
+        """
+        conversa = []
+        historico = []
+        for indice, turno in enumerate(self.turnos):
+            # O histórico é acumulado aqui para não recriá-lo a cada mensagem
+            user_prompt = turno.user_prompt
+            if user_prompt is None:
+                user_prompt = self._reconstruir_user_prompt(indice, turno.agente, historico)
+
+            conversa.append({
+                "turno": turno.turno,
+                "agente": turno.agente,
+                "sistema_prompt": self.sistema_prompt(indice),
+                "user_prompt": user_prompt,
+                "resposta": turno.resposta
+            })
+            historico.append({"role": turno.agente, "content": turno.resposta})
+        return conversa
+
+    def para_dict(self):
+        return {
+            "formato": FORMATO_COMPACTO,
+            "sistemas": self.sistemas,
+            "turnos": [t.para_dict() for t in self.turnos]
+        }
+
+    @classmethod
+    def de_dict(cls, dados):
+        sistemas = {agente: sys.intern(prompt) for agente, prompt in dados["sistemas"].items()}
+        turnos = [
+            Turno(t["turno"], t["agente"], t["resposta"], t.get("sistema_prompt"), t.get("user_prompt"))
+            for t in dados["turnos"]
+        ]
+        return cls(sistemas, turnos)
+
+def carregar_conversa(dados):
+    """
+    Carrega uma conversa salva, aceitando tanto o formato compacto quanto o legado
+    (lista de mensagens com sistema_prompt e user_prompt completos).
+
+    Args:
+        dados: Valor do campo "conversa" lido do JSON
+
+    Returns:
+        ConversaCompacta equivalente, sem perda de informação
+    """
+    if isinstance(dados, dict) and dados.get("formato") == FORMATO_COMPACTO:
+        return ConversaCompacta.de_dict(dados)
+
+    conversa = ConversaCompacta()
+    for msg in dados:
+        conversa.adicionar(
+            msg["turno"], msg["agente"], msg["resposta"], msg["sistema_prompt"], msg["user_prompt"]
+        )
+    return conversa
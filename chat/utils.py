@@ -1,6 +1,38 @@
 import json
 import os
 
+# Instruções enviadas ao comprador (fixas, permitem reconstruir os prompts a partir do histórico)
+INSTRUCAO_PRIMEIRA_PERGUNTA = "Faça uma pergunta direta sobre um carro específico que você quer comprar."
+INSTRUCAO_PROXIMA_PERGUNTA = "Faça uma nova pergunta sobre o mesmo assunto, considerando a resposta anterior do vendedor."
+
+# Respostas pré-definidas usadas quando a API falha (ver gerar_resposta_fallback);
+# o conversor também as usa para identificar registros gerados sem o modelo
+RESPOSTAS_FALLBACK_COMPRADOR = [
+    "Qual o preço deste modelo?",
+    "Quais são as opções de cores disponíveis?",
+    "Este carro tem garantia de fábrica?",
+    "Qual o consumo médio de combustível?",
+    "Quais são os itens de série?",
+    "Tem disponibilidade para pronta entrega?",
+    "Quais são as condições de financiamento?",
+    "Este modelo tem câmbio automático?",
+    "Qual a potência do motor?",
+    "Vocês aceitam carro na troca?"
+]
+
+RESPOSTAS_FALLBACK_VENDEDOR = [
+    "O preço deste modelo é R$ 89.990,00 na versão básica.",
+    "Temos disponibilidade nas cores prata, preto, branco e vermelho.",
+    "Sim, o veículo possui 3 anos de garantia de fábrica.",
+    "O consumo médio é de 12 km/l na cidade e 14 km/l na estrada.",
+    "Este modelo vem equipado com ar-condicionado, direção elétrica e central multimídia.",
+    "Temos unidades disponíveis para pronta entrega nas cores prata e branco.",
+    "Oferecemos financiamento em até 60 meses com taxa a partir de 0,99% ao mês.",
+    "Sim, aceitamos seu veículo usado como parte do pagamento após avaliação.",
+    "O motor tem 130 cavalos de potência e torque de 17,5 kgfm.",
+    "A versão top de linha custa R$ 115.990,00 com todos os opcionais."
+]
+
 def salvar_conversa(conversa, arquivo):
     """
     Salva a conversa em um arquivo JSON.
@@ -14,4 +46,55 @@ def salvar_conversa(conversa, arquivo):
     
     # Verifica se o arquivo foi criado
     if not os.path.exists(arquivo):
-        raise Exception(f"Erro: O arquivo {arquivo} não foi criado.")
\ No newline at end of file
+        raise Exception(f"Erro: O arquivo {arquivo} não foi criado.")
+
+def formatar_historico(historico, perspectiva):
+    """
+    Formata o histórico de conversa com a perspectiva correta (comprador ou vendedor).
+    
+    Args:
+        historico: Lista de mensagens no formato {"role": "comprador"|"vendedor", "content": "mensagem"}
+        perspectiva: "comprador" ou "vendedor" - quem está recebendo o histórico
+        
+    Returns:
+        Lista formatada de mensagens como ['User: mensagem', 'Assistant: resposta', ...]
+    """
+    historico_formatado = []
+    
+    for msg in historico:
+        if perspectiva == "comprador":
+            # Para o comprador, o vendedor é o "User" e o comprador é o "Assistant"
+            if msg["role"] == "vendedor":
+                historico_formatado.append(f"User: {msg['content']}")
+            else:
+                historico_formatado.append(f"Assistant: {msg['content']}")
+        else:  # perspectiva = vendedor
+            # Para o vendedor, o comprador é o "User" e o vendedor é o "Assistant"
+            if msg["role"] == "comprador":
+                historico_formatado.append(f"User: {msg['content']}")
+            else:
+                historico_formatado.append(f"Assistant: {msg['content']}")
+    
+    return historico_formatado
+
+def criar_prompt_template(historico, mensagem_atual, tipo_agente):
+    """
+    Cria o template de prompt para o usuário no formato exato especificado.
+    
+    Args:
+        historico: Lista formatada de mensagens
+        mensagem_atual: A mensagem mais recente do usuário
+        tipo_agente: "comprador" ou "vendedor"
+        
+    Returns:
+        String com o template de prompt formatado
+    """
+    return f"""<|AgenteAtual|>{tipo_agente}<|AgenteAtual|>
+
+You are a specialized AI assistant. Use the conversation history to provide context and respond to the user's message.
+
+Conversation History:
+{historico}
+
+Latest User Message:
+{mensagem_atual}"""
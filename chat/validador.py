@@ -0,0 +1,99 @@
+import json
+import re
+
+# Siglas válidas para o campo "state" do ActionInput
+ESTADOS_BRASIL = {
+    "AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA", "MT", "MS", "MG", "PA",
+    "PB", "PR", "PE", "PI", "RJ", "RN", "RS", "RO", "RR", "SC", "SP", "SE", "TO"
+}
+
+PROXIMO_AGENTE = "ListingAgent"
+RESPOSTA_TRANSICAO = "Movendo para o próximo agente"
+
+# Rótulo opcional que o Response Format de REGRAS_VENDEDOR lista antes de "Thought:"
+ROTULO_ENTRADA = "Input:"
+
+# Abertura tolerada antes dos campos: cerca de código (```) e separador "---"
+PADRAO_ABERTURA = re.compile(r"^\s*(?:```[^\n]*\n\s*)?(?:-{3,}\s*)?")
+
+# Parser de passada única: extrai os quatro campos da resposta do vendedor de uma vez
+PADRAO_RESPOSTA_VENDEDOR = re.compile(
+    PADRAO_ABERTURA.pattern +
+    r"(?:" + re.escape(ROTULO_ENTRADA) + r".*?)?"
+    r"Thought:\s*(?P<thought>.*?)\s*"
+    r"ActionInput:\s*(?P<action_input>.*?)\s*"
+    r"NextAgent:[ \t]*(?P<next_agent>[^\n]*?)\s*"
+    r"FinalResponse:\s*(?P<final_response>.*?)\s*"
+    r"(?:-{3,}\s*)?(?:```\s*)?$",
+    re.DOTALL
+)
+
+def analisar_resposta_vendedor(texto):
+    """
+    Extrai os campos Thought, ActionInput, NextAgent e FinalResponse da resposta do vendedor.
+
+    Args:
+        texto: Resposta do vendedor em texto livre
+
+    Returns:
+        Dicionário com os campos extraídos, ou None se a estrutura não for reconhecida
+    """
+    # Remove marcações de negrito que o modelo costuma adicionar aos rótulos
+    match = PADRAO_RESPOSTA_VENDEDOR.match(texto.replace("**", ""))
+    if not match:
+        return None
+
+    campos = match.groupdict()
+    campos["next_agent"] = campos["next_agent"].strip().strip('"')
+    campos["final_response"] = campos["final_response"].strip().strip('"')
+    return campos
+
+def validar_resposta_vendedor(texto):
+    """
+    Valida a resposta do vendedor: estrutura, JSON do ActionInput e regras de estado e transição.
+
+    Args:
+        texto: Resposta do vendedor em texto livre
+
+    Returns:
+        Tupla (campos, erros) - campos é None se a estrutura não for reconhecida;
+        erros é uma lista vazia quando a resposta é válida
+    """
+    campos = analisar_resposta_vendedor(texto)
+    if campos is None:
+        return None, ["estrutura Thought/ActionInput/NextAgent/FinalResponse não encontrada"]
+
+    erros = []
+
+    try:
+        action_input = json.loads(campos["action_input"])
+    except json.JSONDecodeError as e:
+        return campos, [f"ActionInput não é um JSON válido: {str(e)}"]
+
+    if not isinstance(action_input, dict):
+        return campos, ["ActionInput deve ser um objeto JSON"]
+    campos["action_input"] = action_input
+
+    estado = action_input.get("state")
+    if estado is not None and estado not in ESTADOS_BRASIL:
+        erros.append(f"state inválido: '{estado}' (use a sigla de 2 letras)")
+
+    if campos["next_agent"] not in ("", PROXIMO_AGENTE):
+        erros.append(f"NextAgent inválido: '{campos['next_agent']}'")
+
+    completo = bool(
+        (action_input.get("brand") or action_input.get("model"))
+        and action_input.get("salePrice")
+        and estado
+    )
+    if completo and campos["next_agent"] != PROXIMO_AGENTE:
+        erros.append(f"NextAgent deveria ser '{PROXIMO_AGENTE}' com todos os campos obrigatórios")
+    if not completo and campos["next_agent"] == PROXIMO_AGENTE:
+        erros.append("NextAgent preenchido sem brand/model, salePrice e state")
+    if campos["next_agent"] == PROXIMO_AGENTE and campos["final_response"] != RESPOSTA_TRANSICAO:
+        erros.append(f"FinalResponse deveria ser '{RESPOSTA_TRANSICAO}'")
+
+    if not campos["final_response"]:
+        erros.append("FinalResponse vazio")
+
+    return campos, erros
@@ -1,76 +1,463 @@
+import argparse
+import glob
+import hashlib
 import json
+import re
 import sys
 import os
 
-def convert_json_to_jsonl(input_file, output_file):
+from shard_index import IndexWriter, index_path_for
+from scoring import score_batch, score_records
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Rows buffered per Parquet row group / Arrow record batch
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+# Bump whenever the output of a conversion changes, so incremental runs redo every input
+CONVERTER_VERSION = 4
+MANIFEST_NAME = "manifest.json"
+INPUT_PATTERN = "metadata*.json"
+
+def load_messages(conversation):
+    """
+    Return the conversation as a list of messages, accepting both formats written by chat/main.py:
+    - legacy: list of messages, each with its own sistema_prompt and user_prompt
+    - compact: {"formato": "compacto", "sistemas": {agent: prompt}, "turnos": [...]},
+      where the system prompt is stored once per agent
+    """
+    if isinstance(conversation, dict) and conversation.get("formato") == "compacto":
+        systems = conversation.get("sistemas", {})
+        messages = []
+        for msg in conversation.get("turnos", []):
+            msg = dict(msg)
+            msg.setdefault("sistema_prompt", systems.get(msg.get("agente"), ""))
+            messages.append(msg)
+        return messages
+    return conversation
+
+def iter_conversations(input_data):
+    """
+    Yield (metadata, messages) for each conversation in the input.
+
+    Accepts a single conversation ({"metadados": ..., "conversa": ...}) or the file written
+    by chat/main.py, which maps each scenario type to one such conversation.
+    """
+    if "conversa" in input_data:
+        yield input_data.get("metadados", {}), load_messages(input_data["conversa"])
+        return
+
+    for data in input_data.values():
+        if isinstance(data, dict) and "conversa" in data:
+            yield data.get("metadados", {}), load_messages(data["conversa"])
+
+def pair_turns(messages):
+    """
+    Group the messages by turn and return the (buyer, seller) pairs in turn order.
+    Turns missing either side are skipped.
     """
-    Convert the JSON format to desired JSONL format
-    
+    turns = {}
+    for conv in messages:
+        turn = conv.get("turno")
+        agent = conv.get("agente")
+
+        if turn not in turns:
+            turns[turn] = {}
+
+        turns[turn][agent] = conv
+
+    pairs = []
+    for turn_num, turn_data in sorted(turns.items()):
+        buyer = turn_data.get("comprador")
+        seller = turn_data.get("vendedor")
+
+        if buyer and seller:
+            pairs.append((buyer, seller))
+    return pairs
+
+def build_records(input_data, min_score=None, model_scorer=None):
+    """
+    Build the ShareGPT records of the input, as (record, scenario type, turn) tuples.
+
     For each turn in the conversation:
     - system value = seller agent's system_prompt
     - human value = buyer agent's resposta
     - gpt value = seller agent's resposta
+    - score = quality score of the turn, computed for all records at once (see scoring.py)
+
+    Records scoring below min_score are dropped.
+    """
+    records = []
+    for metadata, messages in iter_conversations(input_data):
+        for buyer, seller in pair_turns(messages):
+            jsonl_obj = {
+                "conversations": [
+                    {"from": "system", "value": seller.get("sistema_prompt", "")},
+                    {"from": "human", "value": buyer.get("resposta", "")},
+                    {"from": "gpt", "value": seller.get("resposta", "")}
+                ],
+                "source": "auto-generated",
+                "score": None
+            }
+            records.append((jsonl_obj, metadata.get("tipo_cenario"), seller.get("turno")))
+
+    score_records([obj for obj, _, _ in records], model_scorer)
+    if min_score is not None:
+        records = [record for record in records if record[0]["score"] >= min_score]
+    return records
+
+class JsonlShardWriter:
+    """
+    Writes JSONL records one at a time, tracking byte offsets for the sidecar index,
+    which is saved on close (unless write_index is False).
+    """
+
+    def __init__(self, output_file, write_index=True):
+        self.output_file = output_file
+        self.write_index = write_index
+        self.index = IndexWriter()
+        self.offset = 0
+        self.file = open(output_file, 'wb')
+
+    @property
+    def count(self):
+        return self.index.count
+
+    def write(self, obj, scenario=None, turn=None):
+        line = (json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8')
+        self.file.write(line)
+        self.index.add(self.offset, len(line), scenario, turn)
+        self.offset += len(line)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        if self.write_index:
+            self.index.write(index_path_for(self.output_file))
+
+def write_jsonl(records, output_file, write_index=True):
+    """
+    Write (record, scenario type, turn) tuples as JSONL, one JSON object per line, plus the sidecar
+    index (output_file + ".idx", see shard_index.py) unless write_index is False.
+    Returns the number of records written.
+    """
+    writer = JsonlShardWriter(output_file, write_index)
+    try:
+        for obj, scenario, turn in records:
+            writer.write(obj, scenario, turn)
+    finally:
+        writer.close()
+    return writer.count
+
+def convert_json_to_jsonl(input_file, output_file, write_index=True, min_score=None, model_scorer=None):
+    """
+    Convert the JSON format to desired JSONL format (see build_records)
+
+    Unless write_index is False, a sidecar index (output_file + ".idx", see shard_index.py)
+    with the byte offset, length, scenario and turn number of every record is written too.
+    Turns scoring below min_score are left out.
     """
     try:
         # Read and parse the input file
         with open(input_file, 'r', encoding='utf-8') as f:
             input_data = json.loads(f.read())
-        
-        # Extract conversations
-        conversations = input_data.get("conversa", [])
-        
-        # Group conversations by turn
-        turns = {}
-        for conv in conversations:
-            turn = conv.get("turno")
-            agent = conv.get("agente")
-            
-            if turn not in turns:
-                turns[turn] = {}
-            
-            turns[turn][agent] = conv
-        
-        # Create JSONL format
-        jsonl_data = []
-        for turn_num, turn_data in sorted(turns.items()):
-            buyer = turn_data.get("comprador")
-            seller = turn_data.get("vendedor")
-            
-            if buyer and seller:
-                jsonl_obj = {
-                    "conversations": [
-                        {"from": "system", "value": seller.get("sistema_prompt", "")},
-                        {"from": "human", "value": buyer.get("resposta", "")},
-                        {"from": "gpt", "value": seller.get("resposta", "")}
-                    ],
-                    "source": "auto-generated",
-                    "score": 5.0
-                }
-                jsonl_data.append(jsonl_obj)
-        
-        # Write output file - one JSON object per line
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for obj in jsonl_data:
-                f.write(json.dumps(obj, ensure_ascii=False) + '\n')
-        
-        return f"Conversion successful! Processed {len(jsonl_data)} conversation turns."
-    
+
+        count = write_jsonl(build_records(input_data, min_score, model_scorer), output_file, write_index)
+
+        return f"Conversion successful! Processed {count} conversation turns."
+
     except json.JSONDecodeError as e:
         return f"JSON parsing error: {str(e)}"
     except Exception as e:
         return f"Error: {str(e)}"
 
+def columnar_schema():
+    """
+    Schema of the columnar export. Low-cardinality columns (the system prompt, source and
+    scenario metadata) are dictionary-encoded, so each distinct value is stored once per
+    row group and can be used for predicate pushdown.
+    """
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("conversation_id", pa.string()),
+        ("turn", pa.int32()),
+        ("scenario_type", dictionary),
+        ("intent", dictionary),
+        ("system", dictionary),
+        ("human", pa.string()),
+        ("gpt", pa.string()),
+        ("source", dictionary),
+        ("score", pa.float32()),
+    ])
+
+def write_columnar(input_data, output_file, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                   min_score=None, model_scorer=None, scenarios=None):
+    """
+    Write the turns of the input to a columnar file: Parquet, or Arrow IPC if output_file
+    ends in .arrow. Holds the same pairs as build_records, one row per turn, plus the
+    scenario metadata. Rows are scored one row group at a time, straight from the human
+    and gpt columns, and rows scoring below min_score are dropped before writing.
+
+    If scenarios is a dict, it is updated with the number of rows written per scenario type.
+    Returns the number of rows written.
+    """
+    schema = columnar_schema()
+    arrow_ipc = output_file.endswith(".arrow")
+    if arrow_ipc:
+        writer = pa.ipc.new_file(output_file, schema)
+    else:
+        writer = pq.ParquetWriter(output_file, schema, use_dictionary=True, compression="zstd")
+
+    columns = {name: [] for name in schema.names}
+    total_rows = 0
+
+    def flush():
+        nonlocal total_rows
+        if not columns["turn"]:
+            return
+
+        # Scores are filled in for the whole row group at once
+        columns["score"] = score_batch(columns["human"], columns["gpt"], model_scorer)
+        if min_score is not None:
+            keep = [i for i, score in enumerate(columns["score"]) if score >= min_score]
+            for name, values in columns.items():
+                values[:] = [values[i] for i in keep]
+
+        total_rows += len(columns["turn"])
+        if scenarios is not None:
+            for scenario in columns["scenario_type"]:
+                scenario = scenario or "unknown"
+                scenarios[scenario] = scenarios.get(scenario, 0) + 1
+
+        if columns["turn"]:
+            table = pa.table(columns, schema=schema)
+            if arrow_ipc:
+                writer.write_table(table, max_chunksize=row_group_size)
+            else:
+                writer.write_table(table, row_group_size=row_group_size)
+        for values in columns.values():
+            values.clear()
+
+    try:
+        for metadata, messages in iter_conversations(input_data):
+            for buyer, seller in pair_turns(messages):
+                columns["conversation_id"].append(metadata.get("id"))
+                columns["turn"].append(seller.get("turno"))
+                columns["scenario_type"].append(metadata.get("tipo_cenario"))
+                columns["intent"].append(metadata.get("intencao"))
+                columns["system"].append(seller.get("sistema_prompt", ""))
+                columns["human"].append(buyer.get("resposta", ""))
+                columns["gpt"].append(seller.get("resposta", ""))
+                columns["source"].append("auto-generated")
+
+                if len(columns["turn"]) >= row_group_size:
+                    flush()
+        flush()
+    finally:
+        writer.close()
+
+    return total_rows
+
+def convert_json_to_columnar(input_file, output_file, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                             min_score=None, model_scorer=None):
+    """
+    Convert the JSON format to a columnar file: Parquet, or Arrow IPC if output_file ends in .arrow
+    (see write_columnar)
+    """
+    if pa is None:
+        return "Error: pyarrow is required for Parquet/Arrow output (pip install pyarrow)."
+
+    try:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            input_data = json.loads(f.read())
+
+        total_rows = write_columnar(input_data, output_file, row_group_size, min_score, model_scorer)
+
+        return f"Conversion successful! Processed {total_rows} conversation turns."
+
+    except json.JSONDecodeError as e:
+        return f"JSON parsing error: {str(e)}"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {"settings": None, "inputs": {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, manifest_path):
+    # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def remove_shard(output_dir, shard):
+    for path in (os.path.join(output_dir, shard), index_path_for(os.path.join(output_dir, shard))):
+        if os.path.exists(path):
+            os.remove(path)
+
+def convert_directory(input_dir, output_dir, output_format="jsonl", min_score=None, model_scorer=None):
+    """
+    Incrementally convert every metadataN.json in input_dir into one shard per input in output_dir.
+
+    output_dir/manifest.json records the converter settings and, per input, its content hash,
+    size/mtime, shard name and record count. Inputs whose hash is unchanged are skipped; new
+    or modified inputs are (re)converted; shards of deleted inputs are removed. A change in the
+    settings (format, CONVERTER_VERSION, min_score or the model scorer's name) reconverts everything.
+    """
+    if output_format in ("parquet", "arrow") and pa is None:
+        return "Error: pyarrow is required for Parquet/Arrow output (pip install pyarrow)."
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    settings = {
+        "version": CONVERTER_VERSION,
+        "format": output_format,
+        "min_score": min_score,
+        "model_scorer": getattr(model_scorer, "name", None)
+    }
+    previous = manifest["inputs"] if manifest.get("settings") == settings else {}
+    if manifest.get("settings") not in (None, settings):
+        print("Converter settings changed; reconverting all inputs.")
+        for entry in manifest["inputs"].values():
+            remove_shard(output_dir, entry["shard"])
+
+    input_files = sorted(
+        glob.glob(os.path.join(input_dir, INPUT_PATTERN)),
+        key=lambda path: [int(p) if p.isdigit() else p for p in re.split(r'(\d+)', os.path.basename(path))]
+    )
+
+    inputs = {}
+    converted = 0
+    try:
+        for input_file in input_files:
+            name = os.path.basename(input_file)
+            stat = os.stat(input_file)
+            entry = previous.get(name)
+
+            # Size and mtime unchanged: reuse the stored hash instead of re-reading the file
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                inputs[name] = entry
+                continue
+
+            sha256 = file_sha256(input_file)
+            if entry and entry["sha256"] == sha256:
+                inputs[name] = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                continue
+
+            shard = os.path.splitext(name)[0] + "." + output_format
+            shard_path = os.path.join(output_dir, shard)
+            with open(input_file, 'r', encoding='utf-8') as f:
+                input_data = json.load(f)
+
+            scenarios = {}
+            if output_format == "jsonl":
+                records = build_records(input_data, min_score, model_scorer)
+                count = write_jsonl(records, shard_path)
+                for _, scenario, _ in records:
+                    scenario = scenario or "unknown"
+                    scenarios[scenario] = scenarios.get(scenario, 0) + 1
+            else:
+                count = write_columnar(input_data, shard_path, min_score=min_score,
+                                       model_scorer=model_scorer, scenarios=scenarios)
+
+            inputs[name] = {
+                "sha256": sha256,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "shard": shard,
+                "records": count,
+                "scenarios": scenarios
+            }
+            converted += 1
+            print(f"Converted {name} -> {shard} ({count} records)")
+    except json.JSONDecodeError as e:
+        return f"JSON parsing error in {name}: {str(e)}"
+    except Exception as e:
+        return f"Error: {str(e)}"
+    finally:
+        if model_scorer is not None and hasattr(model_scorer, "save"):
+            model_scorer.save()
+
+        # Inputs not reached (or the one that failed) keep their previous entries, so the
+        # next run skips them if unchanged instead of reconverting and orphaning their shards
+        input_names = [os.path.basename(path) for path in input_files]
+        for input_name in input_names:
+            if input_name not in inputs and input_name in previous:
+                inputs[input_name] = previous[input_name]
+        inputs = {input_name: inputs[input_name] for input_name in input_names if input_name in inputs}
+
+        # Inputs that disappeared take their shards with them
+        for name, entry in manifest["inputs"].items():
+            if name not in inputs and not os.path.exists(os.path.join(input_dir, name)):
+                remove_shard(output_dir, entry["shard"])
+
+        # Save progress even if a later input failed, so the next run resumes from here
+        totals = {}
+        for entry in inputs.values():
+            for scenario, count in entry["scenarios"].items():
+                totals[scenario] = totals.get(scenario, 0) + count
+        manifest = {
+            "settings": settings,
+            "inputs": inputs,
+            "shards": [entry["shard"] for entry in inputs.values()],
+            "total_records": sum(entry["records"] for entry in inputs.values()),
+            "scenarios": totals
+        }
+        save_manifest(manifest, manifest_path)
+
+    return (f"Conversion successful! Converted {converted} of {len(input_files)} inputs; "
+            f"{manifest['total_records']} conversation turns in {len(inputs)} shards.")
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python converter.py <input_json_file> <output_jsonl_file>")
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    
+    parser = argparse.ArgumentParser(
+        description="Convert generated conversations to ShareGPT JSONL, Parquet or Arrow",
+        usage="%(prog)s <input_json_file> <output_file.jsonl|.parquet|.arrow> [--min-score N]\n"
+              "       %(prog)s <input_dir> <output_dir> [jsonl|parquet|arrow] [--min-score N]"
+    )
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("format", nargs="?", default=None)
+    parser.add_argument("--min-score", type=float, default=None,
+                        help="drop turns scoring below this value (0 to 5, see scoring.py)")
+    args = parser.parse_args()
+
+    input_file = args.input
+    output_file = args.output
+
     if not os.path.exists(input_file):
         print(f"Error: Input file '{input_file}' not found.")
         sys.exit(1)
-    
-    result = convert_json_to_jsonl(input_file, output_file)
-    print(result)
\ No newline at end of file
+
+    if os.path.isdir(input_file):
+        output_format = args.format or "jsonl"
+        if output_format not in ("jsonl", "parquet", "arrow"):
+            print(f"Error: Unknown output format '{output_format}'.")
+            sys.exit(1)
+        result = convert_directory(input_file, output_file, output_format, args.min_score)
+    elif args.format is not None:
+        print("Error: The output format argument is only used with an input directory.")
+        sys.exit(1)
+    elif output_file.endswith((".parquet", ".arrow")):
+        result = convert_json_to_columnar(input_file, output_file, min_score=args.min_score)
+    else:
+        result = convert_json_to_jsonl(input_file, output_file, min_score=args.min_score)
+    print(result)
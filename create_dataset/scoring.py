@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import re
+import sys
+
+# The seller output parser and the canned fallback answers live with the generator, in chat/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chat'))
+from utils import RESPOSTAS_FALLBACK_COMPRADOR, RESPOSTAS_FALLBACK_VENDEDOR
+from validador import validar_resposta_vendedor
+
+# Scores range from 0 to MAX_SCORE (the constant every record used to get)
+MAX_SCORE = 5.0
+
+# Weight of each heuristic signal in the score. The format, fallback and language signals
+# multiply the weighted sum instead: invalid, canned or non-Portuguese turns are unusable
+# however well sized (the pipeline's validation stage drops the same invalid answers)
+WEIGHTS = {"length": 0.5, "repetition": 0.5}
+
+# Same sentence limit the generator enforces on the FinalResponse (MAX_FRASES_CURTAS in chat/main.py)
+MAX_SENTENCES = 2
+MIN_RESPONSE_CHARS = 15
+MAX_RESPONSE_CHARS = 400
+
+FALLBACK_TEXTS = frozenset(RESPOSTAS_FALLBACK_COMPRADOR) | frozenset(RESPOSTAS_FALLBACK_VENDEDOR)
+
+# Common function words of each language; "a", "e", "do" and "no" are left out as they occur in both
+PORTUGUESE_WORDS = frozenset(
+    "o os as de da das dos que é um uma para com não em na nas nos por se mais qual quais "
+    "você vocês seu sua tem como isso este esta esse essa meu minha ao pelo pela".split()
+)
+ENGLISH_WORDS = frozenset(
+    "the and is are of to you your what which this that with for have has it does can how".split()
+)
+
+WORD = re.compile(r"\w+")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+def format_signal(parsed):
+    """1.0 for a seller answer that passes validar_resposta_vendedor, 0.0 otherwise."""
+    return [0.0 if fields is None or errors else 1.0 for fields, errors in parsed]
+
+def length_signal(responses):
+    """
+    1.0 when the final response has 1 to MAX_SENTENCES sentences and a sensible length,
+    0.5 when it is up to twice over, 0.0 when empty or longer than that.
+    """
+    signals = []
+    for text in responses:
+        sentences = sum(1 for s in SENTENCE_BREAK.split(text.strip()) if WORD.search(s))
+        if sentences == 0:
+            signals.append(0.0)
+        elif sentences <= MAX_SENTENCES and MIN_RESPONSE_CHARS <= len(text) <= MAX_RESPONSE_CHARS:
+            signals.append(1.0)
+        elif sentences <= 2 * MAX_SENTENCES and len(text) <= 2 * MAX_RESPONSE_CHARS:
+            signals.append(0.5)
+        else:
+            signals.append(0.0)
+    return signals
+
+def repetition_signal(texts):
+    """Share of distinct word trigrams in the text (1.0 means nothing is repeated)."""
+    signals = []
+    for text in texts:
+        words = WORD.findall(text.lower())
+        trigrams = list(zip(words, words[1:], words[2:]))
+        signals.append(len(set(trigrams)) / len(trigrams) if trigrams else 1.0)
+    return signals
+
+def language_signal(texts):
+    """Share of Portuguese among the function words found (1.0 when there are none to tell)."""
+    signals = []
+    for text in texts:
+        words = WORD.findall(text.lower())
+        portuguese = sum(1 for w in words if w in PORTUGUESE_WORDS)
+        english = sum(1 for w in words if w in ENGLISH_WORDS)
+        signals.append(portuguese / (portuguese + english) if portuguese + english else 1.0)
+    return signals
+
+def fallback_signal(humans, gpts):
+    """0.0 for turns where either side is a canned fallback answer instead of model output."""
+    return [
+        0.0 if human.strip() in FALLBACK_TEXTS or gpt.strip() in FALLBACK_TEXTS else 1.0
+        for human, gpt in zip(humans, gpts)
+    ]
+
+def score_batch(humans, gpts, model_scorer=None):
+    """
+    Score a batch of turns given as parallel columns of buyer questions and seller answers.
+    Each signal is computed over the whole column at once, so the parser and the regexes
+    run in tight loops instead of once per record through the writers.
+
+    Args:
+        humans: Buyer questions (the ShareGPT "human" values)
+        gpts: Seller answers (the ShareGPT "gpt" values)
+        model_scorer: Optional callable taking a list of (human, gpt) pairs and returning
+            one score in [0, MAX_SCORE] per pair (see CachedModelScorer); its score is
+            averaged with the heuristic one
+
+    Returns:
+        List of scores in [0, MAX_SCORE], rounded to 2 decimals
+    """
+    parsed = [validar_resposta_vendedor(gpt) for gpt in gpts]
+    # The length and language checks apply to what the buyer actually reads
+    final_responses = [
+        fields["final_response"] if fields is not None else gpt
+        for (fields, _), gpt in zip(parsed, gpts)
+    ]
+
+    signals = {
+        "length": length_signal(final_responses),
+        "repetition": repetition_signal(gpts),
+    }
+    gates = zip(
+        format_signal(parsed),
+        fallback_signal(humans, gpts),
+        language_signal([f"{h}\n{r}" for h, r in zip(humans, final_responses)])
+    )
+
+    scores = []
+    for i, (valid, fallback, language) in enumerate(gates):
+        weighted = sum(weight * signals[name][i] for name, weight in WEIGHTS.items())
+        scores.append(MAX_SCORE * valid * fallback * language * weighted)
+
+    if model_scorer is not None and scores:
+        model_scores = model_scorer(list(zip(humans, gpts)))
+        scores = [(score + model_score) / 2 for score, model_score in zip(scores, model_scores)]
+
+    return [round(score, 2) for score in scores]
+
+def score_records(records, model_scorer=None):
+    """Set the "score" of every ShareGPT record in the list, scoring them as one batch."""
+    humans = []
+    gpts = []
+    for record in records:
+        messages = {msg["from"]: msg["value"] for msg in record["conversations"]}
+        humans.append(messages.get("human", ""))
+        gpts.append(messages.get("gpt", ""))
+
+    for record, score in zip(records, score_batch(humans, gpts, model_scorer)):
+        record["score"] = score
+    return records
+
+class CachedModelScorer:
+    """
+    Wraps a model-based scorer (e.g. an LLM judge) so it is called in batches of batch_size
+    and only for turns it has not scored before. Scores are cached by the hash of the
+    question and answer, and persisted to cache_path (if given) on save().
+
+    score_fn receives a list of (human, gpt) pairs and returns one score in [0, MAX_SCORE] per pair.
+    """
+
+    def __init__(self, score_fn, name, batch_size=32, cache_path=None):
+        self.score_fn = score_fn
+        # Recorded in the conversion manifest, so changing the scorer reconverts the inputs
+        self.name = name
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+        self.cache = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self.cache = json.load(f)
+
+    @staticmethod
+    def key(human, gpt):
+        return hashlib.sha1(f"{human}\0{gpt}".encode('utf-8')).hexdigest()
+
+    def __call__(self, pairs):
+        keys = [self.key(human, gpt) for human, gpt in pairs]
+
+        pending = {}
+        for key, pair in zip(keys, pairs):
+            if key not in self.cache:
+                pending.setdefault(key, pair)
+
+        pending = list(pending.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            scores = self.score_fn([pair for _, pair in batch])
+            for (key, _), score in zip(batch, scores):
+                self.cache[key] = min(max(float(score), 0.0), MAX_SCORE)
+
+        return [self.cache[key] for key in keys]
+
+    def save(self):
+        if not self.cache_path:
+            return
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,244 @@
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+
+# Sidecar index layout:
+#   MAGIC | header length (uint32) | JSON header {"count", "scenarios"} | fixed-size entries
+# Each entry: byte offset (uint64), record length (uint32), scenario id (uint16),
+# turn number of the record in its conversation (uint16, 0 when unknown)
+MAGIC = b"DRZIDX1\0"
+HEADER_LENGTH = struct.Struct("<I")
+ENTRY = struct.Struct("<QIHH")
+INDEX_SUFFIX = ".idx"
+
+def index_path_for(shard_path):
+    return shard_path + INDEX_SUFFIX
+
+class IndexWriter:
+    """
+    Collects (offset, length, scenario, turn) entries while a shard is written
+    and saves them as the sidecar index.
+    """
+
+    def __init__(self):
+        self.entries = bytearray()
+        self.scenarios = []
+        self.scenario_ids = {}
+        self.count = 0
+
+    def add(self, offset, length, scenario, turn):
+        scenario = scenario or ""
+        scenario_id = self.scenario_ids.get(scenario)
+        if scenario_id is None:
+            scenario_id = self.scenario_ids[scenario] = len(self.scenarios)
+            self.scenarios.append(scenario)
+        self.entries += ENTRY.pack(offset, length, scenario_id, turn or 0)
+        self.count += 1
+
+    def write(self, index_path):
+        header = json.dumps({"count": self.count, "scenarios": self.scenarios}, ensure_ascii=False).encode("utf-8")
+        with open(index_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            f.write(self.entries)
+
+def build_index(shard_path):
+    """
+    Build the index of an existing JSONL shard with a full scan.
+    ShareGPT records carry no scenario or turn metadata, so both are left unknown.
+    """
+    writer = IndexWriter()
+    offset = 0
+    with open(shard_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                writer.add(offset, len(line), "", 0)
+            offset += len(line)
+    writer.write(index_path_for(shard_path))
+    return writer.count
+
+class ShardIndex:
+    """
+    Random access to a JSONL shard through its sidecar index. Both files are memory-mapped,
+    so opening the index and reading any record costs O(1) regardless of the shard size.
+    """
+
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        with open(index_path_for(shard_path), "rb") as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._index[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Invalid index file for shard '{shard_path}'")
+
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        (header_length,) = HEADER_LENGTH.unpack_from(self._index, len(MAGIC))
+        header = json.loads(self._index[header_start:header_start + header_length])
+        self.count = header["count"]
+        self.scenarios = header["scenarios"]
+        self._entries_start = header_start + header_length
+
+        with open(shard_path, "rb") as f:
+            # mmap cannot map an empty file
+            self._shard = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, i):
+        """Return (offset, length, scenario, turn) for record i."""
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        offset, length, scenario_id, turn = ENTRY.unpack_from(self._index, self._entries_start + i * ENTRY.size)
+        return offset, length, self.scenarios[scenario_id], turn
+
+    def raw(self, i):
+        offset, length, _, _ = self.entry(i)
+        return self._shard[offset:offset + length]
+
+    def __getitem__(self, i):
+        return json.loads(self.raw(i))
+
+    def scenario(self, i):
+        return self.entry(i)[2]
+
+    def turn(self, i):
+        return self.entry(i)[3]
+
+    def split(self, val_fraction, seed=0):
+        """
+        Deterministic train/val split of the record indices: the same seed and index
+        always give the same split.
+        """
+        indices = list(range(self.count))
+        random.Random(seed).shuffle(indices)
+        val_size = int(round(self.count * val_fraction))
+        return sorted(indices[val_size:]), sorted(indices[:val_size])
+
+    def sample(self, size, seed=0, stratify=False):
+        """
+        Sample `size` record indices. With stratify="scenario" (or True) or stratify="turn"
+        the sample keeps the shard's proportions of that key: `size` is split across the
+        groups by largest remainder, with at least one record per group when size allows.
+        """
+        rng = random.Random(seed)
+        size = min(size, self.count)
+        if not stratify:
+            return sorted(rng.sample(range(self.count), size))
+
+        key = self.turn if stratify == "turn" else self.scenario
+        groups = {}
+        for i in range(self.count):
+            groups.setdefault(key(i), []).append(i)
+        groups = [indices for _, indices in sorted(groups.items())]
+
+        exact = [size * len(indices) / self.count for indices in groups]
+        quotas = [int(q) for q in exact]
+        by_remainder = sorted(range(len(groups)), key=lambda g: exact[g] - quotas[g], reverse=True)
+        for g in by_remainder[:size - sum(quotas)]:
+            quotas[g] += 1
+
+        if size >= len(groups):
+            # Move records from the largest quotas to the groups left empty
+            for g in range(len(groups)):
+                if quotas[g] == 0:
+                    donor = max(range(len(groups)), key=lambda d: quotas[d])
+                    quotas[donor] -= 1
+                    quotas[g] += 1
+
+        sample = []
+        for indices, quota in zip(groups, quotas):
+            sample.extend(rng.sample(indices, quota))
+        return sorted(sample)
+
+    def write_subset(self, indices, output_path):
+        """Copy the selected records to a new shard, with its own index."""
+        writer = IndexWriter()
+        offset = 0
+        with open(output_path, "wb") as f:
+            for i in indices:
+                _, length, scenario, turn = self.entry(i)
+                f.write(self.raw(i))
+                writer.add(offset, length, scenario, turn)
+                offset += length
+        writer.write(index_path_for(output_path))
+        return writer.count
+
+    def close(self):
+        self._index.close()
+        if self.count:
+            self._shard.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offset index over JSONL shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build the index of an existing shard")
+    build.add_argument("shard")
+
+    info = subparsers.add_parser("info", help="number of records per scenario")
+    info.add_argument("shard")
+
+    get = subparsers.add_parser("get", help="print record i")
+    get.add_argument("shard")
+    get.add_argument("i", type=int)
+
+    split = subparsers.add_parser("split", help="deterministic train/val split")
+    split.add_argument("shard")
+    split.add_argument("val_fraction", type=float)
+    split.add_argument("train_output")
+    split.add_argument("val_output")
+    split.add_argument("--seed", type=int, default=0)
+
+    sample = subparsers.add_parser("sample", help="random (optionally stratified) subsample")
+    sample.add_argument("shard")
+    sample.add_argument("size", type=int)
+    sample.add_argument("output")
+    sample.add_argument("--seed", type=int, default=0)
+    sample.add_argument("--stratify", nargs="?", const="scenario", choices=["scenario", "turn"],
+                        help="keep the proportions of each scenario (default) or turn number")
+
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.shard):
+        print(f"Error: Shard '{args.shard}' not found.")
+        sys.exit(1)
+
+    if args.command == "build":
+        print(f"Indexed {build_index(args.shard)} records.")
+        return
+
+    index = ShardIndex(args.shard)
+    if args.command == "info":
+        counts = {}
+        for i in range(len(index)):
+            scenario = index.scenario(i) or "(unknown)"
+            counts[scenario] = counts.get(scenario, 0) + 1
+        print(f"{len(index)} records")
+        for scenario, count in sorted(counts.items()):
+            print(f"  {scenario}: {count}")
+    elif args.command == "get":
+        # Negative indices count from the end, as in Python
+        i = args.i + len(index) if args.i < 0 else args.i
+        if not 0 <= i < len(index):
+            print(f"Error: Record {args.i} out of range (shard has {len(index)} records).")
+            index.close()
+            sys.exit(1)
+        print(index.raw(i).decode("utf-8").rstrip("\n"))
+    elif args.command == "split":
+        train, val = index.split(args.val_fraction, args.seed)
+        index.write_subset(train, args.train_output)
+        index.write_subset(val, args.val_output)
+        print(f"Split into {len(train)} train and {len(val)} val records.")
+    elif args.command == "sample":
+        indices = index.sample(args.size, args.seed, args.stratify)
+        index.write_subset(indices, args.output)
+        print(f"Sampled {len(indices)} records.")
+    index.close()
+
+if __name__ == "__main__":
+    main()